@@ -3,56 +3,167 @@ import pandas as pd
 import numpy as np
 import subprocess
 import os
-import shutil
 from tabulate import tabulate
 from decimal import Decimal, getcontext, ROUND_HALF_UP
 import datetime
 import sys
+import time
+import json
+import fcntl
+import atexit
+import zlib
+import re
+import mmap
+import errno
+import resource
+import argparse
 import requests
 from requests.auth import HTTPBasicAuth
+from requests.adapters import HTTPAdapter
 import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from statistics import NormalDist
 
 
 getcontext().prec = 30  # Higher precision for large numbers
 
-def get_metrics_from_ovirt(vm_id):
-    engine_url = "https://engine.local/ovirt-engine"
-    api_url = f"{engine_url}/api"
-    sso_url = f"{engine_url}/sso/oauth/token"
-    username = "admin@ovirt@internalsso"
-    password = "ravi001"
-
-    # Step 1: Get SSO token
-    try:
-        token_resp = requests.post(
-            sso_url,
-            headers={"Accept": "application/json"},
-            data={
-                "grant_type": "password",
-                "username": username,
-                "password": password,
-                "scope": "ovirt-app-api"
-            },
-            verify=False
-        )
-        if token_resp.status_code != 200:
-            print(f"[ERROR] Token fetch failed: {token_resp.status_code}")
-            return 0.0, 0, 0
-        access_token = token_resp.json().get("access_token")
-    except Exception as e:
-        print(f"[ERROR] Token request failed: {e}")
-        return 0.0, 0, 0
+# Databases and working directories; the environment overrides are for
+# local runs against scratch copies (see entropy_benchmark.py)
+BACKUP_INDEX_DB = os.environ.get("ASPAR_BACKUP_INDEX_DB", "/root/Backup_Index.db")
+ASPAR_DB = os.environ.get("ASPAR_DB", "/root/aspar.db")
+VM_SETTINGS_DB = os.environ.get("ASPAR_VM_SETTINGS_DB", "/root/vmSettings.db")
+
+ENGINE_URL = "https://engine.local/ovirt-engine"
+API_URL = f"{ENGINE_URL}/api"
+SSO_URL = f"{ENGINE_URL}/sso/oauth/token"
+USERNAME = "admin@ovirt@internalsso"
+PASSWORD = "ravi001"
 
-    # Step 2: Query VM statistics using the token
+# Token shared by every entropy_analysis.py process on this host
+TOKEN_CACHE_FILE = "/root/.ovirt_sso_token.json"
+TOKEN_DEFAULT_TTL = 1800     # seconds, when the SSO reply has no expiry
+TOKEN_REFRESH_MARGIN = 60    # refresh this long before expiry
+
+_session = None
+
+def get_ovirt_session():
+    """
+    One keep-alive requests.Session per process, so repeated calls reuse
+    the TLS connection to the engine.
+    """
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        _session.verify = False
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32)
+        _session.mount("https://", adapter)
+    return _session
+
+def _read_cached_token():
     try:
-        response = requests.get(
-            f"{api_url}/vms/{vm_id}/statistics",
+        with open(TOKEN_CACHE_FILE) as f:
+            cached = json.load(f)
+        if cached.get("expires_at", 0) - TOKEN_REFRESH_MARGIN > time.time():
+            return cached.get("access_token")
+    except (OSError, ValueError):
+        pass
+    return None
+
+def _token_expiry(token_json):
+    if token_json.get("expires_in"):
+        return time.time() + float(token_json["expires_in"])
+    if token_json.get("exp"):
+        exp = float(token_json["exp"])
+        return exp / 1000 if exp > 1e12 else exp  # engine may report ms
+    return time.time() + TOKEN_DEFAULT_TTL
+
+def get_sso_token(force_refresh=False):
+    """
+    Returns a valid SSO access token, from TOKEN_CACHE_FILE when it has not
+    expired. The file is locked while a new token is fetched so concurrent
+    processes do not all hit /sso/oauth/token.
+    """
+    if not force_refresh:
+        token = _read_cached_token()
+        if token:
+            return token
+
+    with open(TOKEN_CACHE_FILE + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        # another process may have refreshed it while we waited
+        if not force_refresh:
+            token = _read_cached_token()
+            if token:
+                return token
+        try:
+            token_resp = get_ovirt_session().post(
+                SSO_URL,
+                headers={"Accept": "application/json"},
+                data={
+                    "grant_type": "password",
+                    "username": USERNAME,
+                    "password": PASSWORD,
+                    "scope": "ovirt-app-api"
+                },
+            )
+            if token_resp.status_code != 200:
+                print(f"[ERROR] Token fetch failed: {token_resp.status_code}")
+                return None
+            token_json = token_resp.json()
+            access_token = token_json.get("access_token")
+        except Exception as e:
+            print(f"[ERROR] Token request failed: {e}")
+            return None
+
+        tmp_file = TOKEN_CACHE_FILE + ".tmp"
+        try:
+            fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                json.dump({"access_token": access_token,
+                           "expires_at": _token_expiry(token_json)}, f)
+            os.replace(tmp_file, TOKEN_CACHE_FILE)
+        except OSError as e:
+            print(f"[WARNING] Could not cache SSO token: {e}")
+        return access_token
+
+def ovirt_get(path, accept="application/xml"):
+    """
+    GET {API_URL}{path} over the pooled session with the cached token.
+    A 401 forces one token refresh and retry. Returns the response or None.
+    """
+    access_token = get_sso_token()
+    if not access_token:
+        return None
+    response = None
+    for attempt in range(2):
+        response = get_ovirt_session().get(
+            f"{API_URL}{path}",
             headers={
                 "Authorization": f"Bearer {access_token}",
-                "Accept": "application/xml"
+                "Accept": accept
             },
-            verify=False
         )
+        if response.status_code != 401 or attempt:
+            break
+        # cached token was revoked or the engine restarted
+        access_token = get_sso_token(force_refresh=True)
+        if not access_token:
+            return None
+    return response
+
+def metrics_from_stats(stats):
+    cpu = float(stats.get("cpu.current.total", 0))
+    mem_free = int(float(stats.get("memory.free", 0)))
+    swap_used = int(float(stats.get("memory.used", 0)))  # approximate
+    return cpu, mem_free, swap_used
+
+def get_metrics_from_ovirt(vm_id):
+    # Query VM statistics with the cached token, over the pooled session
+    try:
+        response = ovirt_get(f"/vms/{vm_id}/statistics")
+        if response is None:
+            return 0.0, 0, 0
         if response.status_code != 200:
             print(f"[ERROR] Failed to fetch stats: {response.status_code}")
             return 0.0, 0, 0
@@ -66,11 +177,7 @@ def get_metrics_from_ovirt(vm_id):
             if value is not None:
                 stats[name] = value
 
-        cpu = float(stats.get("cpu.current.total", 0))
-        mem_free = int(stats.get("memory.free", 0))
-        swap_used = int(stats.get("memory.used", 0))  # approximate
-
-        return cpu, mem_free, swap_used
+        return metrics_from_stats(stats)
 
     except Exception as e:
         print(f"[ERROR] oVirt API stats failed: {e}")
@@ -81,7 +188,113 @@ def get_metrics_from_ovirt(vm_id):
 # 0) SYSTEM METRICS COLLECTOR
 ##############################
 
+# Fleet snapshots written by `entropy_analysis.py --collect-stats`
+# (vm_metrics_snapshots in aspar.db). A snapshot younger than
+# STATS_SNAPSHOT_MAX_AGE seconds is used instead of calling the engine.
+STATS_SNAPSHOT_MAX_AGE = 300
+STATS_COLLECTOR_WORKERS = 16
+
+def get_protected_vm_ids():
+    conn = sqlite3.connect(VM_SETTINGS_DB)
+    try:
+        rows = conn.execute("""
+            SELECT vmId FROM vmAttribs
+            WHERE APSAR_enabled IS NULL OR APSAR_enabled NOT IN (0, '0', 'false', 'FALSE')
+        """).fetchall()
+        return [row[0] for row in rows]
+    finally:
+        conn.close()
+
+def parse_statistics_json(payload):
+    """
+    {name: datum} from the JSON form of /vms/{id}/statistics.
+    """
+    stats = {}
+    for stat in payload.get("statistic", []):
+        values = stat.get("values", {}).get("value", [])
+        if values and values[0].get("datum") is not None:
+            stats[stat.get("name")] = values[0]["datum"]
+    return stats
+
+def fetch_vm_statistics(vm_id):
+    response = ovirt_get(f"/vms/{vm_id}/statistics", accept="application/json")
+    if response is None or response.status_code != 200:
+        status = response.status_code if response is not None else "no token"
+        print(f"[ERROR] Failed to fetch stats for {vm_id}: {status}")
+        return None
+    return metrics_from_stats(parse_statistics_json(response.json()))
+
+def collect_fleet_metrics(vm_ids=None, workers=STATS_COLLECTOR_WORKERS):
+    """
+    Fetches statistics for every protected VM concurrently (bounded thread
+    pool, one shared token and session) and writes them as one snapshot to
+    vm_metrics_snapshots. Returns the number of VMs stored.
+    """
+    if vm_ids is None:
+        vm_ids = get_protected_vm_ids()
+    if not vm_ids or not get_sso_token():
+        return 0
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(vm_ids)))) as pool:
+        futures = {pool.submit(fetch_vm_statistics, vm_id): vm_id for vm_id in vm_ids}
+        for fut in as_completed(futures):
+            try:
+                metrics = fut.result()
+            except Exception as e:
+                print(f"[ERROR] Stats for {futures[fut]}: {e}")
+                continue
+            if metrics is not None:
+                results[futures[fut]] = metrics
+
+    timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    conn = sqlite3.connect(ASPAR_DB)
+    try:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS vm_metrics_snapshots (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                vm_id TEXT,
+                timestamp TEXT,
+                epoch REAL,
+                cpu_usage REAL,
+                mem_free_kb INTEGER,
+                mem_used_kb INTEGER
+            )
+        """)
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_vm_metrics_snapshots_vm_epoch
+            ON vm_metrics_snapshots(vm_id, epoch)
+        """)
+        now = time.time()
+        conn.executemany("""
+            INSERT INTO vm_metrics_snapshots (vm_id, timestamp, epoch, cpu_usage, mem_free_kb, mem_used_kb)
+            VALUES (?,?,?,?,?,?)
+        """, [(vm_id, timestamp, now, *metrics) for vm_id, metrics in results.items()])
+        conn.commit()
+    finally:
+        conn.close()
+    print(f"[INFO] Stored metrics snapshot for {len(results)}/{len(vm_ids)} VM(s).")
+    return len(results)
+
+def get_latest_metrics_snapshot(vm_id_input, max_age=STATS_SNAPSHOT_MAX_AGE):
+    try:
+        conn = sqlite3.connect(ASPAR_DB)
+        try:
+            row = conn.execute("""
+                SELECT cpu_usage, mem_free_kb, mem_used_kb FROM vm_metrics_snapshots
+                WHERE vm_id = ? AND epoch >= ?
+                ORDER BY epoch DESC LIMIT 1
+            """, (vm_id_input, time.time() - max_age)).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None  # no collector has run yet
+    return tuple(row) if row else None
+
 def get_sys_metrics(vm_id_input):
+    snapshot = get_latest_metrics_snapshot(vm_id_input)
+    if snapshot is not None:
+        return snapshot
     try:
         cpu_usage, mem_free_kb, mem_used_kb = get_metrics_from_ovirt(vm_id_input)
     except Exception as e:
@@ -101,17 +314,19 @@ def get_backup_paths(vm_id_input):
     """
     Fetch the 'Backup_path' from table_BI_{vm_id_input} 
     where Full_Backup=25 and Checkpoint IS NOT NULL.
-    Returns a comma-separated string of .raw paths.
+    Returns (comma-separated string of .raw paths, checkpoint, disk_id).
     """
     sanitized_vm_id = vm_id_input.replace('-', '')
     table_name = f"table_BI_{sanitized_vm_id}"
 
-    conn = sqlite3.connect('/root/Backup_Index.db')
+    conn = sqlite3.connect(BACKUP_INDEX_DB)
     cursor = conn.cursor()
     paths_str = None
+    checkpoint = None
+    disk_id = None
     try:
         cursor.execute(f"""
-            SELECT Backup_path FROM {table_name}
+            SELECT Backup_path, Checkpoint, disk_id FROM {table_name}
             WHERE Full_Backup=25
               AND Checkpoint IS NOT NULL
             ORDER BY Date DESC, Time DESC
@@ -119,94 +334,1319 @@ def get_backup_paths(vm_id_input):
         """)
         row = cursor.fetchone()
         if row:
-            paths_str = row[0]
+            paths_str, checkpoint, disk_id = row
     except Exception as e:
         print(f"[ERROR] get_backup_paths: {e}")
     finally:
         conn.close()
 
-    return paths_str
+    return paths_str, checkpoint, disk_id
 
 ##############################
-# 2) FILE COPY & LIST
+# 2) RAW FILE LIST
 ##############################
-def copy_and_list_files(paths_str):
+def list_raw_files(paths_str):
     """
-    Splits comma-separated .raw paths, copies them to /backup/tmp,
-    returns the list of copied file paths.
+    Splits comma-separated .raw paths and returns the ones that exist.
+    The extents are read in place; nothing is copied to /backup/tmp.
     """
     if not paths_str:
         print("[WARNING] No .raw path string.")
         return []
 
-    raw_paths = [p.strip() for p in paths_str.split(',')]
-    
-    print("[INFO] The following .raw files will be copied into /backup/tmp/:")
+    raw_paths = [p.strip() for p in paths_str.split(',') if p.strip()]
+
+    print("[INFO] The following .raw files will be scanned in place:")
+    raw_files = []
     for path in raw_paths:
-        print(f"   {path}")
+        if not os.path.isfile(path):
+            print(f"[WARNING] Source file not found: {path}")
+            continue
+        print(f"   {path} ({os.path.getsize(path)} bytes)")
+        raw_files.append(path)
 
-    copied_files = []
-    for src in raw_paths:
-        if not os.path.isfile(src):
-            print(f"[WARNING] Source file not found: {src}")
+    return raw_files
+
+##############################
+# 2b) STREAMING BYTE HISTOGRAM
+##############################
+CHUNK_SIZE = 16 * 1024 * 1024  # 16 MiB per read, peak memory stays ~constant
+SPLIT_SIZE = 256 * 1024 * 1024  # large extents are split into ranges of this size
+BLOCK_SIZE = 1024 * 1024        # entropy map window; CHUNK_SIZE/SPLIT_SIZE must be multiples
+HISTOGRAM_WORKERS = int(os.environ.get("ASPAR_WORKERS", os.cpu_count() or 1))
+
+# How extents are read:
+#   buffered  plain read(), a new bytes object per chunk
+#   fadvise   preadv into one reused page-aligned buffer, sequential hint,
+#             pages dropped from the page cache once scanned
+#   direct    as fadvise but with O_DIRECT (bypasses the page cache);
+#             falls back to fadvise where the filesystem refuses O_DIRECT
+READ_MODE = os.environ.get("ASPAR_READ_MODE", "fadvise")
+DIRECT_IO_ALIGN = 4096
+
+def _fadvise(fd, offset, length, advice):
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fd, offset, length, advice)
+        except OSError:
+            pass  # only a hint
+
+def open_extent(path, mode=None):
+    """
+    Returns (fd, direct) for reading path in the given read mode.
+    """
+    mode = mode or READ_MODE
+    if mode == "direct" and hasattr(os, "O_DIRECT"):
+        try:
+            return os.open(path, os.O_RDONLY | os.O_DIRECT), True
+        except OSError as e:
+            if e.errno != errno.EINVAL:
+                raise
+    return os.open(path, os.O_RDONLY), False
+
+def aligned_buffer(size):
+    """
+    Page-aligned, reusable read buffer (anonymous mmap) as a uint8 array,
+    rounded up to DIRECT_IO_ALIGN.
+    """
+    size = -(-size // DIRECT_IO_ALIGN) * DIRECT_IO_ALIGN
+    return np.frombuffer(mmap.mmap(-1, size), dtype=np.uint8)
+
+def pread_into(fd, buf, want, offset, direct=False):
+    """
+    Reads up to want bytes at offset into buf; returns the byte count.
+    O_DIRECT reads are issued in whole DIRECT_IO_ALIGN units and trimmed.
+    """
+    if direct:
+        want_aligned = -(-want // DIRECT_IO_ALIGN) * DIRECT_IO_ALIGN
+        return min(os.preadv(fd, [buf[:want_aligned]], offset), want)
+    return os.preadv(fd, [buf[:want]], offset)
+
+def iter_file_chunks(path, chunk_size=CHUNK_SIZE, offset=0, length=None, mode=None):
+    """
+    Yields successive uint8 arrays of at most chunk_size bytes from path,
+    starting at offset and stopping after length bytes (None = to EOF).
+    Except in "buffered" mode every array is a view of the same buffer and
+    is overwritten by the next read.
+    """
+    mode = mode or READ_MODE
+    remaining = length
+    if mode == "buffered":
+        with open(path, 'rb', buffering=0) as f:
+            if offset:
+                f.seek(offset)
+            while remaining is None or remaining > 0:
+                want = chunk_size if remaining is None else min(chunk_size, remaining)
+                chunk = f.read(want)
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield np.frombuffer(chunk, dtype=np.uint8)
+        return
+
+    fd, direct = open_extent(path, mode)
+    try:
+        buf = aligned_buffer(chunk_size)
+        _fadvise(fd, offset, length or 0, os.POSIX_FADV_SEQUENTIAL)
+        pos = offset
+        while remaining is None or remaining > 0:
+            want = chunk_size if remaining is None else min(chunk_size, remaining)
+            try:
+                n = pread_into(fd, buf, want, pos, direct)
+            except OSError as e:
+                if not (direct and e.errno == errno.EINVAL):
+                    raise
+                # filesystem accepted O_DIRECT at open but not for reads
+                os.close(fd)
+                fd, direct = open_extent(path, "fadvise")
+                continue
+            if n == 0:
+                break
+            if remaining is not None:
+                remaining -= n
+            yield buf[:n]
+            if not direct:
+                _fadvise(fd, pos, n, os.POSIX_FADV_DONTNEED)
+            pos += n
+    finally:
+        os.close(fd)
+
+def block_histograms(arr, block_size=BLOCK_SIZE):
+    """
+    Per-block 256-bin histograms of arr in one bincount call.
+    Returns (counts[n_blocks, 256], sizes[n_blocks]); a short last block
+    is kept with its real size.
+    """
+    n_full = len(arr) // block_size
+    n_blocks = n_full + (1 if len(arr) % block_size else 0)
+    counts = np.zeros((n_blocks, 256), dtype=np.int64)
+    sizes = np.full(n_blocks, block_size, dtype=np.int64)
+    if n_full:
+        full = arr[:n_full*block_size].reshape(n_full, block_size)
+        idx = full.astype(np.int32) + (np.arange(n_full, dtype=np.int32)*256)[:, None]
+        counts[:n_full] = np.bincount(idx.ravel(), minlength=n_full*256).reshape(n_full, 256)
+    if n_blocks > n_full:
+        tail = arr[n_full*block_size:]
+        counts[n_full] = np.bincount(tail, minlength=256)
+        sizes[n_full] = len(tail)
+    return counts, sizes
+
+def block_entropies(counts, sizes):
+    """
+    Shannon entropy (bits/byte) of each row of a per-block histogram.
+    """
+    if len(sizes) == 0:
+        return np.zeros(0, dtype=np.float32)
+    probs = counts / sizes[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        terms = np.where(probs > 0, probs*np.log2(probs), 0.0)
+    return (0.0 - terms.sum(axis=1)).astype(np.float32)
+
+##############################
+# 2b-0) RANDOMNESS BATTERY (ent-style)
+##############################
+# Mergeable state over a byte stream: the sum of products of adjacent bytes
+# and the number of pairs in it (for the serial correlation), a 65536-bin
+# bigram histogram, first/last byte to join adjacent pieces, and Monte
+# Carlo pi counts over 6-byte (24-bit x, 24-bit y) points.
+# The bigram only counts every other pair (bytes 2k, 2k+1 of each chunk,
+# one bincount over a 16-bit view): the bigram entropy is an estimate from
+# half the pairs, while the serial correlation stays exact (a float32 dot
+# product over the bytes in short rows, see adjacent_products). The bigram is
+# int64 while a range is scanned; finished scans carry it packed into the
+# smallest dtype that holds its counts, which is what goes through the
+# worker pool and into the histogram cache.
+# On 16 MiB chunks the battery costs 1.4-1.9x the plain byte bincount, down
+# from ~2.5x with a full pair bincount (entropy_benchmark.py's battery and
+# histogram stages).
+MC_RADIUS_SQ = (256**3 - 1) ** 2
+# 256 * 255 * 255 < 2**24: every float32 partial sum of a row is exact
+PAIR_DOT_ROW = 256
+MC_POINT = np.dtype([("xh", ">u2"), ("xl", "u1"), ("yh", ">u2"), ("yl", "u1")])
+
+def battery_state():
+    return {"bigram": np.zeros(65536, dtype=np.int64), "sxy": 0, "pairs": 0, "first": None, "last": None,
+            "mc_inside": 0, "mc_total": 0}
+
+def bigram_pack(bigram):
+    """
+    The bigram in the smallest unsigned dtype its counts fit in (uint8 for
+    a 64 KiB extent, 128 KiB for a 16 MiB chunk instead of 512 KiB).
+    """
+    return bigram.astype(np.min_scalar_type(int(bigram.max(initial=0))))
+
+def bigram_add(dense, bigram):
+    """
+    Adds a dense or packed bigram into the int64 array dense.
+    """
+    dense += bigram
+    return dense
+
+def bigram_dense(bigram):
+    return bigram.astype(np.int64)
+
+def adjacent_products(arr, row=PAIR_DOT_ROW):
+    """
+    Exact sum of arr[i]*arr[i+1]: float32 dot products over rows of
+    row pairs, whose partial sums stay exact integers, summed in float64.
+    """
+    values = arr.astype(np.float32)
+    k = (len(values) - 1) // row * row
+    rows = np.einsum("ij,ij->i", values[:k].reshape(-1, row), values[1:k + 1].reshape(-1, row))
+    total = rows.sum(dtype=np.float64)
+    return int(total + values[k:-1].astype(np.float64) @ values[k + 1:])
+
+def battery_update(state, arr, contiguous=True):
+    """
+    Adds a chunk to the state. contiguous=True joins it to the previous
+    chunk with one boundary pair; sampled blocks pass False.
+    """
+    if len(arr) == 0:
+        return state
+    if len(arr) > 1:
+        state["sxy"] += adjacent_products(arr)
+        state["pairs"] += len(arr) - 1
+        state["bigram"] += np.bincount(arr[:len(arr) & ~1].view(">u2"), minlength=65536)
+    if contiguous and state["last"] is not None:
+        state["sxy"] += state["last"] * int(arr[0])
+        state["pairs"] += 1
+    if state["first"] is None:
+        state["first"] = int(arr[0])
+    state["last"] = int(arr[-1])
+
+    # Monte Carlo pi, points aligned to the chunk start; a <6 byte tail is skipped
+    n_points = len(arr) // 6
+    if n_points:
+        # view each point as two big-endian 16+8 bit coordinates, no copy
+        points = arr[:n_points*6].view(MC_POINT)
+        x = points["xh"].astype(np.int64)
+        x <<= 8
+        x |= points["xl"]
+        y = points["yh"].astype(np.int64)
+        y <<= 8
+        y |= points["yl"]
+        x *= x
+        y *= y
+        x += y
+        state["mc_inside"] += int(np.count_nonzero(x <= MC_RADIUS_SQ))
+        state["mc_total"] += n_points
+    return state
+
+def battery_merge_all(states, contiguous=True):
+    """
+    State of the streams in states one after another, summed into a single
+    dense bigram (packed on return).
+    """
+    dense = np.zeros(65536, dtype=np.int64)
+    merged = {"sxy": 0, "pairs": 0, "first": None, "last": None, "mc_inside": 0, "mc_total": 0}
+    for state in states:
+        bigram_add(dense, state["bigram"])
+        merged["sxy"] += state["sxy"]
+        merged["pairs"] += state["pairs"]
+        if contiguous and merged["last"] is not None and state["first"] is not None:
+            merged["sxy"] += merged["last"] * state["first"]
+            merged["pairs"] += 1
+        if merged["first"] is None:
+            merged["first"] = state["first"]
+        if state["last"] is not None:
+            merged["last"] = state["last"]
+        merged["mc_inside"] += state["mc_inside"]
+        merged["mc_total"] += state["mc_total"]
+    merged["bigram"] = bigram_pack(dense)
+    return merged
+
+def battery_merge(a, b, contiguous=True):
+    """
+    State of stream a followed by stream b (bigram packed).
+    """
+    return battery_merge_all([a, b], contiguous)
+
+def battery_metrics(freq, state, wrap=True):
+    """
+    Arithmetic mean, serial correlation coefficient, Monte Carlo pi and
+    bigram entropy (bits per byte pair, max 16). With wrap the SCC is ent's
+    (last byte wrapped to the first, n pairs); without it (sampled blocks)
+    it is the correlation over the pairs actually counted, with the byte
+    mean and variance of freq (the blocks' edge bytes are ~1e-6 of it).
+    """
+    n = float(freq.sum())
+    if n == 0:
+        return {"arithmetic_mean": 0.0, "serial_correlation": 0.0,
+                "monte_carlo_pi": 0.0, "bigram_entropy": 0.0}
+    values = np.arange(256, dtype=np.float64)
+    sx = float(np.dot(values, freq))
+    sxx = float(np.dot(values**2, freq))
+    sxy = float(state["sxy"])
+    denom = n*sxx - sx*sx
+    if wrap:
+        if state["last"] is not None:
+            sxy += state["last"] * state["first"]
+        scc = (n*sxy - sx*sx) / denom if denom else 0.0
+    else:
+        n_pairs = state["pairs"]
+        scc = (n*n*sxy/n_pairs - sx*sx) / denom if denom and n_pairs else 0.0
+
+    dense = bigram_dense(state["bigram"])
+    pairs = dense.sum()
+    bigram_entropy = 0.0
+    if pairs:
+        p = dense[dense > 0] / pairs
+        bigram_entropy = float(0.0 - np.sum(p*np.log2(p)))
+    mc_pi = 4.0 * state["mc_inside"] / state["mc_total"] if state["mc_total"] else 0.0
+    return {"arithmetic_mean": sx/n, "serial_correlation": float(scc),
+            "monte_carlo_pi": mc_pi, "bigram_entropy": bigram_entropy}
+
+##############################
+# 2b-0b) COMPRESSIBILITY
+##############################
+# A COMPRESS_SAMPLE_BYTES slice every COMPRESS_SAMPLE_STRIDE blocks is
+# compressed with zlib level 1 while the chunk is in memory. Encrypted
+# data stays at ratio ~1.0; high-entropy but structured data does not.
+# The stride runs over file offsets, not chunk starts, and each file starts
+# at a fixed phase derived from its path, so small extents are sampled at
+# the same byte rate as large ones (a 64 KiB extent holds a slice ~1 time
+# in 128) and per-file cache entries stay valid.
+COMPRESS_SAMPLE_BYTES = 64 * 1024
+COMPRESS_SAMPLE_STRIDE = 8
+COMPRESS_LEVEL = 1
+INCOMPRESSIBLE_RATIO = 0.98
+
+def compress_sample_phase(path, block_size=BLOCK_SIZE, stride=COMPRESS_SAMPLE_STRIDE,
+                          sample_bytes=COMPRESS_SAMPLE_BYTES):
+    """
+    Position of the file start in the sampling period, a multiple of
+    sample_bytes (so slices never straddle chunks) that is stable across
+    processes and runs.
+    """
+    slots = max(1, (block_size * stride) // sample_bytes)
+    return (zlib.crc32(os.fsencode(path)) % slots) * sample_bytes
+
+def compress_ratios(arr, block_size=BLOCK_SIZE, stride=COMPRESS_SAMPLE_STRIDE,
+                    sample_bytes=COMPRESS_SAMPLE_BYTES, position=0):
+    """
+    compressed/original size of the sampled slices of one chunk. position
+    is the chunk start in the sampling period (file offset plus the file's
+    compress_sample_phase).
+    """
+    ratios = []
+    period = block_size * stride
+    for start in range((-position) % period, len(arr), period):
+        piece = arr[start:start + sample_bytes]
+        if len(piece):
+            ratios.append(len(zlib.compress(piece, COMPRESS_LEVEL)) / len(piece))
+    return np.array(ratios, dtype=np.float32)
+
+def compressibility_summary(ratios, threshold=INCOMPRESSIBLE_RATIO):
+    if len(ratios) == 0:
+        return {"compress_ratio_mean": 0.0, "compress_ratio_p10": 0.0,
+                "compress_ratio_p50": 0.0, "compress_ratio_p90": 0.0,
+                "incompressible_fraction": 0.0}
+    p10, p50, p90 = np.quantile(ratios, [0.10, 0.50, 0.90])
+    return {
+        "compress_ratio_mean": float(np.mean(ratios)),
+        "compress_ratio_p10": float(p10),
+        "compress_ratio_p50": float(p50),
+        "compress_ratio_p90": float(p90),
+        "incompressible_fraction": float(np.mean(ratios >= threshold)),
+    }
+
+##############################
+# 2b-0c) CONTENT CLASSES
+##############################
+# Each block is classified from the raw extent bytes alone (no guest
+# filesystem): files start on filesystem-block boundaries, so the first
+# bytes of every MAGIC_UNIT_SIZE unit are matched against known
+# compressed/media container headers. A match only counts if the bytes
+# after the signature pass a structural check: short signatures such as
+# JPEG's ff d8 ff alone match random data far too often. Per block:
+#   BLOCK_MAGIC         a validated header starts inside the block
+#   BLOCK_TEXT          mostly printable ASCII / whitespace
+#   BLOCK_HIGH_ENTROPY  >= CONTENT_HIGH_ENTROPY_BITS with no header
+#   BLOCK_OTHER         anything else
+# The first block of every extent also has BLOCK_EXTENT_START set, so
+# content_summary does not carry a header across extents.
+BLOCK_OTHER, BLOCK_MAGIC, BLOCK_TEXT, BLOCK_HIGH_ENTROPY = 0, 1, 2, 3
+BLOCK_EXTENT_START = 0x80
+MAGIC_UNIT_SIZE = 4096
+TEXT_BYTES_FRACTION = 0.95
+CONTENT_HIGH_ENTROPY_BITS = 7.5
+MAGIC_HEADER_BYTES = 32
+
+def _jpeg_header(h):
+    # the first segment's own identifier (JFIF, Exif, Adobe, Photoshop) or,
+    # for a bare quantization table, its exact length (one or two tables)
+    marker, seglen = h[3], (h[4] << 8) | h[5]
+    if marker == 0xe0:
+        return h[6:11] in (b"JFIF\x00", b"JFXX\x00")
+    if marker == 0xe1:
+        return h[6:12] == b"Exif\x00\x00" or h[6:10] == b"http"
+    if marker == 0xed:
+        return h[6:15] == b"Photoshop"
+    if marker == 0xee:
+        return h[6:11] == b"Adobe"
+    if marker == 0xdb:
+        return seglen in (67, 132)
+    return False
+
+def _gzip_header(h):
+    # reserved flag bits clear, XFL 0/2/4, known OS byte
+    return h[3] & 0xe0 == 0 and h[8] in (0, 2, 4) and (h[9] <= 13 or h[9] == 255)
+
+def _bzip2_header(h):
+    # block size digit, then a block or end-of-stream magic
+    return 0x31 <= h[3] <= 0x39 and h[4:10] in (b"\x31\x41\x59\x26\x53\x59", b"\x17\x72\x45\x38\x50\x90")
+
+def _id3_header(h):
+    # version 2-4, not ff revision, syncsafe size
+    return h[3] in (2, 3, 4) and h[4] != 0xff and all(b < 0x80 for b in h[6:10])
+
+def _mp4_header(h):
+    # box size of ftyp, printable major brand
+    size = int.from_bytes(h[0:4], "big")
+    return 8 <= size <= 4096 and all(32 <= b < 127 for b in h[8:12])
+
+# (offset, signature, structural check of the first MAGIC_HEADER_BYTES or None)
+MAGIC_SIGNATURES = [
+    (0, b"\xff\xd8\xff", _jpeg_header),                               # JPEG
+    (0, b"\x89PNG\r\n\x1a\n", None),                                  # PNG
+    (0, b"GIF8", lambda h: h[4:6] in (b"7a", b"9a")),                 # GIF
+    (0, b"PK\x03\x04", lambda h: h[5] == 0 and h[4] <= 63),            # ZIP, docx/xlsx, jar, apk
+    (0, b"\x1f\x8b\x08", _gzip_header),                               # gzip
+    (0, b"BZh", _bzip2_header),                                       # bzip2
+    (0, b"\xfd7zXZ\x00", None),                                       # xz
+    (0, b"\x28\xb5\x2f\xfd", lambda h: h[4] & 0x08 == 0),               # zstd
+    (0, b"\x04\x22\x4d\x18", lambda h: h[4] & 0xc2 == 0x40),            # lz4 frame
+    (0, b"\xff\x06\x00\x00sNaP", None),                               # snappy framed
+    (0, b"7z\xbc\xaf\x27\x1c", None),                                  # 7z
+    (0, b"Rar!\x1a\x07", None),                                       # RAR
+    (0, b"MSCF", lambda h: h[4:8] == b"\x00\x00\x00\x00"),             # CAB
+    (0, b"%PDF", lambda h: h[4:5] == b"-"),                           # PDF
+    (4, b"ftyp", _mp4_header),                                        # MP4/MOV/HEIC
+    (0, b"OggS", lambda h: h[4] == 0),                                # Ogg
+    (0, b"fLaC", lambda h: h[4] & 0x7f == 0),                         # FLAC
+    (0, b"ID3", _id3_header),                                         # MP3
+    (0, b"RIFF", lambda h: h[8:12] in (b"WEBP", b"AVI ", b"WAVE")),  # WebP, AVI, WAV
+    (0, b"\x1a\x45\xdf\xa3", lambda h: b"\x42\x86" in h[4:MAGIC_HEADER_BYTES]),  # Matroska/WebM
+]
+
+def _magic_table(signatures):
+    values, masks = [], []
+    for offset, sig, _ in signatures:
+        value, mask = bytearray(8), bytearray(8)
+        sig = sig[:8 - offset]
+        value[offset:offset + len(sig)] = sig
+        mask[offset:offset + len(sig)] = b"\xff" * len(sig)
+        values.append(int.from_bytes(value, "little"))
+        masks.append(int.from_bytes(mask, "little"))
+    return np.array(values, dtype=np.uint64), np.array(masks, dtype=np.uint64)
+
+PRINTABLE_BYTES = np.zeros(256, dtype=bool)
+PRINTABLE_BYTES[[9, 10, 13]] = True
+PRINTABLE_BYTES[32:127] = True
+
+def magic_header(head):
+    """
+    Does head start with a known container header that passes its
+    structural check.
+    """
+    head = bytes(head[:MAGIC_HEADER_BYTES]).ljust(MAGIC_HEADER_BYTES, b"\x00")
+    for offset, sig, check in MAGIC_SIGNATURES:
+        if head[offset:offset + len(sig)] == sig and (check is None or check(head)):
+            return True
+    return False
+
+MAGIC_VALUES, MAGIC_MASKS = _magic_table(MAGIC_SIGNATURES)
+
+def block_magic_hits(arr, block_size=BLOCK_SIZE, offset=0, unit=MAGIC_UNIT_SIZE):
+    """
+    Per-block flag: does a validated container header start on a unit
+    boundary (of the extent file, arr starting at offset) inside the block.
+    """
+    hits = np.zeros(-(-len(arr) // block_size), dtype=bool)
+    first = -offset % unit
+    starts = np.arange(first, len(arr) - 7, unit)
+    if len(starts):
+        # cheap signature prefilter, then the structural check per candidate
+        heads = np.ascontiguousarray(arr[starts[:, None] + np.arange(8)])
+        words = heads.view("<u8").ravel()
+        candidates = starts[((words[:, None] & MAGIC_MASKS) == MAGIC_VALUES).any(axis=1)]
+        for start in candidates:
+            if magic_header(arr[start:start + MAGIC_HEADER_BYTES]):
+                hits[start // block_size] = True
+    return hits
+
+def classify_blocks(counts, sizes, entropies, magic):
+    classes = np.full(len(sizes), BLOCK_OTHER, dtype=np.uint8)
+    if len(sizes) == 0:
+        return classes
+    printable = counts[:, PRINTABLE_BYTES].sum(axis=1) / np.maximum(sizes, 1)
+    classes[entropies >= CONTENT_HIGH_ENTROPY_BITS] = BLOCK_HIGH_ENTROPY
+    classes[printable >= TEXT_BYTES_FRACTION] = BLOCK_TEXT
+    classes[magic] = BLOCK_MAGIC
+    return classes
+
+def mark_extent_start(classes, extent_start=True):
+    if extent_start and len(classes):
+        classes[0] |= BLOCK_EXTENT_START
+    return classes
+
+def content_summary(block_class, block_bytes, total_bytes, contiguous=True):
+    """
+    Checkpoint breakdown into known-compressed, text-like and unknown
+    high-entropy data. With contiguous blocks, high-entropy blocks that
+    directly follow a header block in the same extent are the rest of that
+    compressed stream. Fractions are of the classified bytes (block_bytes
+    per block; blocks at extent ends are short); byte counts scale them to
+    total_bytes, which for a full scan is the classified bytes themselves.
+    """
+    if len(block_class) == 0:
+        return {"known_compressed_fraction": 0.0, "text_fraction": 0.0,
+                "unknown_high_entropy_fraction": 0.0, "known_compressed_bytes": 0,
+                "text_bytes": 0, "unknown_high_entropy_bytes": 0}
+    starts = (block_class & BLOCK_EXTENT_START) != 0
+    block_class = block_class & ~np.uint8(BLOCK_EXTENT_START)
+    known = block_class == BLOCK_MAGIC
+    high = block_class == BLOCK_HIGH_ENTROPY
+    if contiguous:
+        # closest preceding block that is not high-entropy or starts an
+        # extent; only a header block as anchor extends the stream
+        anchor = np.maximum.accumulate(np.where(high & ~starts, -1, np.arange(len(block_class))))
+        known |= high & (anchor >= 0) & known[np.maximum(anchor, 0)]
+    weights = np.asarray(block_bytes, dtype=np.float64)
+    classified = weights.sum()
+    def byte_fraction(mask):
+        return float(weights[mask].sum() / classified) if classified else 0.0
+    fractions = {
+        "known_compressed_fraction": byte_fraction(known),
+        "text_fraction": byte_fraction(block_class == BLOCK_TEXT),
+        "unknown_high_entropy_fraction": byte_fraction(high & ~known),
+    }
+    summary = dict(fractions)
+    for name, fraction in fractions.items():
+        summary[name.replace("_fraction", "_bytes")] = int(round(fraction * total_bytes))
+    return summary
+
+##############################
+# 2b-0d) SCAN RESULTS
+##############################
+# A scan of a range, a file or a whole checkpoint is a dict:
+#   freq (256 int64), block_map (float32 per block), battery (see 2b-0),
+#   compress_ratios (float32 per sampled slice), block_class (uint8 per block),
+#   block_bytes (uint32 length of each block)
+def empty_scan():
+    return {"freq": np.zeros(256, dtype=np.int64),
+            "block_map": np.zeros(0, dtype=np.float32),
+            "battery": battery_state(),
+            "compress_ratios": np.zeros(0, dtype=np.float32),
+            "block_class": np.zeros(0, dtype=np.uint8),
+            "block_bytes": np.zeros(0, dtype=np.uint32)}
+
+def merge_scans(a, b, contiguous=True):
+    """
+    Scan of the bytes of a followed by the bytes of b.
+    """
+    return merge_scan_list([a, b], contiguous)
+
+def merge_scan_list(scans, contiguous=True):
+    """
+    merge_scans over a list in one pass (one bigram accumulator, one
+    concatenation per array) instead of pairwise.
+    """
+    if len(scans) == 1:
+        return scans[0]
+    if not scans:
+        return empty_scan()
+    return {"freq": np.sum([scan["freq"] for scan in scans], axis=0),
+            "block_map": np.concatenate([scan["block_map"] for scan in scans]),
+            "battery": battery_merge_all([scan["battery"] for scan in scans], contiguous),
+            "compress_ratios": np.concatenate([scan["compress_ratios"] for scan in scans]),
+            "block_class": np.concatenate([scan["block_class"] for scan in scans]),
+            "block_bytes": np.concatenate([scan["block_bytes"] for scan in scans])}
+
+def byte_histogram_range(task):
+    """
+    Scan (byte histogram, per-block entropy map, battery state,
+    compressibility samples and block classes) of one (path, offset, length,
+    chunk_size, block_size) range. Module-level so it can be shipped to pool
+    workers.
+    """
+    path, offset, length, chunk_size, block_size = task
+    freq = np.zeros(256, dtype=np.int64)
+    battery = battery_state()
+    entropies = []
+    ratios = []
+    classes = []
+    lengths = []
+    position = offset + compress_sample_phase(path, block_size)
+    extent_start = offset == 0
+    for arr in iter_file_chunks(path, chunk_size, offset, length):
+        counts, sizes = block_histograms(arr, block_size)
+        freq += counts.sum(axis=0)
+        entropies.append(block_entropies(counts, sizes))
+        battery_update(battery, arr)
+        ratios.append(compress_ratios(arr, block_size, position=position))
+        magic = block_magic_hits(arr, block_size, offset)
+        position += len(arr)
+        offset += len(arr)
+        classes.append(mark_extent_start(classify_blocks(counts, sizes, entropies[-1], magic), extent_start))
+        lengths.append(sizes)
+        extent_start = False
+    scan = empty_scan()
+    scan["freq"] = freq
+    battery["bigram"] = bigram_pack(battery["bigram"])
+    scan["battery"] = battery
+    if entropies:
+        scan["block_map"] = np.concatenate(entropies)
+        scan["compress_ratios"] = np.concatenate(ratios)
+        scan["block_class"] = np.concatenate(classes)
+        scan["block_bytes"] = np.concatenate(lengths).astype(np.uint32)
+    return scan
+
+def byte_histogram_batch(tasks, merge_bigrams=False):
+    """
+    Scans of several ranges in one worker call. With merge_bigrams the
+    batch's bigrams are summed onto its first scan (the others carry none),
+    which is all a merged checkpoint scan needs.
+    """
+    scans = [byte_histogram_range(task) for task in tasks]
+    if merge_bigrams and len(scans) > 1:
+        total = np.zeros(65536, dtype=np.int64)
+        for scan in scans:
+            bigram_add(total, scan["battery"]["bigram"])
+            scan["battery"]["bigram"] = bigram_pack(np.zeros(65536, dtype=np.int64))
+        scans[0]["battery"]["bigram"] = bigram_pack(total)
+    return scans
+
+def plan_task_batches(tasks, workers, batch_bytes=None):
+    """
+    Groups consecutive ranges into batches of about batch_bytes (default:
+    CHUNK_SIZE*4, but small enough to give every worker a few), so small
+    extents do not cost one pool round trip each.
+    """
+    if batch_bytes is None:
+        total = sum(task[2] for task in tasks)
+        batch_bytes = max(1, min(CHUNK_SIZE * 4, total // (4 * max(1, workers))))
+    batches, current, current_bytes = [], [], 0
+    for i, task in enumerate(tasks):
+        if current and current_bytes + task[2] > batch_bytes:
+            batches.append(current)
+            current, current_bytes = [], 0
+        current.append(i)
+        current_bytes += task[2]
+    if current:
+        batches.append(current)
+    return batches
+
+def byte_histogram_file(path, chunk_size=CHUNK_SIZE, block_size=BLOCK_SIZE):
+    """
+    256-bin byte histogram of a single extent file, read chunk by chunk.
+    """
+    return byte_histogram_range((path, 0, None, chunk_size, block_size))["freq"]
+
+def plan_histogram_ranges(raw_files, chunk_size=CHUNK_SIZE, split_size=SPLIT_SIZE,
+                          block_size=BLOCK_SIZE):
+    """
+    Splits the extent files into (path, offset, length, chunk_size, block_size)
+    work units of at most split_size bytes each.
+    """
+    tasks = []
+    for path in raw_files:
+        try:
+            size = os.path.getsize(path)
+        except OSError as e:
+            print(f"[ERROR] Reading {path}: {e}")
             continue
-        dst = os.path.join("/backup/tmp", os.path.basename(src))
+        # an empty extent still gets one (empty) range so it is cached
+        for offset in range(0, max(size, 1), split_size):
+            tasks.append((path, offset, min(split_size, size - offset), chunk_size, block_size))
+    return tasks
+
+_worker_pool = None
+_worker_pool_size = 0
+
+def get_worker_pool(workers=None):
+    """
+    Process pool shared by every scan in this process (batch/daemon runs
+    reuse it across VMs) with workers processes (HISTOGRAM_WORKERS by
+    default). Asking for another size replaces it.
+    """
+    global _worker_pool, _worker_pool_size
+    size = max(1, HISTOGRAM_WORKERS if workers is None else workers)
+    if _worker_pool is not None and _worker_pool_size != size:
+        _worker_pool.shutdown()
+        _worker_pool = None
+    if _worker_pool is None:
+        _worker_pool_size = size
+        _worker_pool = ProcessPoolExecutor(max_workers=_worker_pool_size)
+        atexit.register(_worker_pool.shutdown)
+    return _worker_pool
+
+def reset_worker_pool():
+    """
+    Drops a broken pool (a worker died) so the next scan starts a new one.
+    """
+    global _worker_pool
+    if _worker_pool is not None:
+        _worker_pool.shutdown(wait=False, cancel_futures=True)
+        _worker_pool = None
+
+def histogram_files(raw_files, chunk_size=CHUNK_SIZE, workers=HISTOGRAM_WORKERS,
+                    split_size=SPLIT_SIZE, block_size=BLOCK_SIZE, per_file_bigrams=True):
+    """
+    Per-file scans. With workers > 1 batches of ranges are scanned in a
+    pool of that many processes. Returns {path: scan}; files with a read error are left
+    out. per_file_bigrams=False lets each batch merge its bigrams (fine
+    when only the merged checkpoint scan is used, not for the cache).
+    """
+    tasks = plan_histogram_ranges(raw_files, chunk_size, split_size, block_size)
+    results = [None] * len(tasks)
+    failed = set()
+    pool_size = workers
+    workers = max(1, min(workers, len(tasks)))
+    batches = plan_task_batches(tasks, workers)
+
+    def scan_batch(batch):
+        # a read error fails the whole batch; retry its ranges one by one
         try:
-            shutil.copy2(src, dst)
-            print(f"[INFO] Copied {src} -> {dst}")
-            copied_files.append(dst)
-        except Exception as e:
-            print(f"[ERROR] Copy failed: {src}: {e}")
+            for i, scan in zip(batch, byte_histogram_batch([tasks[i] for i in batch], not per_file_bigrams)):
+                results[i] = scan
+        except OSError:
+            for i in batch:
+                try:
+                    results[i] = byte_histogram_range(tasks[i])
+                except OSError as e:
+                    print(f"[ERROR] Reading {tasks[i][0]}: {e}")
+                    failed.add(tasks[i][0])
+
+    pending = batches
+    if workers > 1 and len(batches) > 1:
+        pool = get_worker_pool(pool_size)
+        print(f"[INFO] Histogramming {len(tasks)} range(s) in {len(batches)} batch(es) "
+              f"with {_worker_pool_size} workers.")
+        futures = {pool.submit(byte_histogram_batch, [tasks[i] for i in batch], not per_file_bigrams): batch
+                   for batch in batches}
+        try:
+            for fut in as_completed(futures):
+                batch = futures[fut]
+                try:
+                    for i, scan in zip(batch, fut.result()):
+                        results[i] = scan
+                except OSError:
+                    pass  # rescanned range by range below
+        except BrokenProcessPool as e:
+            # the batches not finished yet are scanned serially below
+            print(f"[WARNING] Histogram worker pool broke ({e}); continuing serially.")
+            reset_worker_pool()
+        pending = [batch for batch in batches if any(results[i] is None for i in batch)]
+
+    for batch in pending:
+        scan_batch(batch)
+
+    # ranges of one file are contiguous and in offset order
+    parts = {}
+    for task, result in zip(tasks, results):
+        if task[0] not in failed:
+            parts.setdefault(task[0], []).append(result)
+    return {path: merge_scan_list(scans) for path, scans in parts.items()}
+
+def merge_file_histograms(raw_files, per_file):
+    """
+    Merges per-file scans in raw_files order (the extents form one stream,
+    as if concatenated). Returns the checkpoint scan with total_bytes added.
+    """
+    scan = dict(merge_scan_list([per_file[path] for path in raw_files if path in per_file]))
+    scan["total_bytes"] = int(scan["freq"].sum())
+    return scan
+
+def stream_byte_histogram(raw_files, chunk_size=CHUNK_SIZE, workers=HISTOGRAM_WORKERS,
+                          split_size=SPLIT_SIZE, block_size=BLOCK_SIZE):
+    """
+    Scan of all extent files: running 256-bin histogram, per-block entropy
+    map and block classes (in file/offset order), battery state and
+    compressibility samples.
+    """
+    per_file = histogram_files(raw_files, chunk_size, workers, split_size, block_size,
+                               per_file_bigrams=False)
+    return merge_file_histograms(raw_files, per_file)
+
+##############################
+# 2b-1) HISTOGRAM CACHE
+##############################
+HISTOGRAM_CACHE_DB = os.environ.get("ASPAR_HISTOGRAM_CACHE_DB", "/root/histogram_cache.db")
+HISTOGRAM_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# every blob column counts towards HISTOGRAM_CACHE_MAX_BYTES
+CACHE_ENTRY_BYTES = ("LENGTH(histogram) + LENGTH(block_map) + COALESCE(LENGTH(battery), 0)"
+                     " + COALESCE(LENGTH(compress_ratios), 0) + COALESCE(LENGTH(block_class), 0)"
+                     " + COALESCE(LENGTH(bigram_packed), 0) + COALESCE(LENGTH(block_bytes), 0)")
+
+def encode_bigram(bigram):
+    packed = bigram_pack(bigram)
+    return zlib.compress(packed.astype(packed.dtype.newbyteorder('<')).tobytes(), 1)
+
+def decode_bigram(blob):
+    # the item size follows from the length: 65536 bins of 1, 2, 4 or 8 bytes
+    raw = zlib.decompress(blob)
+    return np.frombuffer(raw, dtype=f'<u{len(raw) // 65536}').copy()
+
+def open_histogram_cache(cache_db=HISTOGRAM_CACHE_DB):
+    conn = sqlite3.connect(cache_db)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS extent_histograms (
+            path TEXT,
+            size INTEGER,
+            mtime_ns INTEGER,
+            block_size INTEGER,
+            histogram BLOB,
+            block_map BLOB,
+            last_used REAL,
+            PRIMARY KEY (path, size, mtime_ns, block_size)
+        )
+    """)
+    ensure_columns(conn.cursor(), "extent_histograms", [
+        ("battery", "BLOB"),          # old dense bigram, no longer written
+        ("first_byte", "INTEGER"),
+        ("last_byte", "INTEGER"),
+        ("mc_inside", "INTEGER"),
+        ("mc_total", "INTEGER"),
+        ("compress_ratios", "BLOB"),  # float32
+        ("block_class", "BLOB"),      # uint8
+        ("bigram_packed", "BLOB"),    # zlib-compressed bigram in its smallest uint dtype
+        ("block_bytes", "BLOB"),      # uint32
+        ("sxy", "INTEGER"),
+        ("pairs", "INTEGER"),
+    ])
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_extent_histograms_last_used ON extent_histograms(last_used)")
+    return conn
+
+def cache_lookup(conn, path, st, block_size=BLOCK_SIZE):
+    """
+    Returns the scan of an unchanged extent, or None.
+    """
+    key = (path, st.st_size, st.st_mtime_ns, block_size)
+    row = conn.execute("""
+        SELECT histogram, block_map, bigram_packed, first_byte, last_byte, mc_inside, mc_total, compress_ratios,
+               block_class, block_bytes, sxy, pairs
+        FROM extent_histograms
+        WHERE path=? AND size=? AND mtime_ns=? AND block_size=?
+    """, key).fetchone()
+    # entries written before a column existed are treated as misses
+    if row is None or row[2] is None or row[7] is None or row[8] is None or row[9] is None or row[10] is None:
+        return None
+    conn.execute("""
+        UPDATE extent_histograms SET last_used=?
+        WHERE path=? AND size=? AND mtime_ns=? AND block_size=?
+    """, (time.time(), *key))
+    return {
+        "freq": np.frombuffer(row[0], dtype=np.int64).copy(),
+        "block_map": np.frombuffer(row[1], dtype=np.float32).copy(),
+        "battery": {
+            "bigram": decode_bigram(row[2]),
+            "sxy": row[10], "pairs": row[11],
+            "first": row[3], "last": row[4], "mc_inside": row[5], "mc_total": row[6],
+        },
+        "compress_ratios": np.frombuffer(row[7], dtype=np.float32).copy(),
+        "block_class": np.frombuffer(row[8], dtype=np.uint8).copy(),
+        "block_bytes": np.frombuffer(row[9], dtype=np.uint32).copy(),
+    }
+
+def cache_store(conn, path, st, scan, block_size=BLOCK_SIZE):
+    # older versions of the same path can never hit again
+    conn.execute("DELETE FROM extent_histograms WHERE path=?", (path,))
+    battery = scan["battery"]
+    conn.execute("""
+        INSERT INTO extent_histograms (path, size, mtime_ns, block_size, histogram, block_map, last_used,
+                                       bigram_packed, first_byte, last_byte, mc_inside, mc_total, compress_ratios,
+                                       block_class, block_bytes, sxy, pairs)
+        VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+    """, (path, st.st_size, st.st_mtime_ns, block_size,
+          scan["freq"].astype(np.int64).tobytes(), scan["block_map"].astype(np.float32).tobytes(),
+          time.time(),
+          encode_bigram(battery["bigram"]),
+          battery["first"], battery["last"], battery["mc_inside"], battery["mc_total"],
+          scan["compress_ratios"].astype(np.float32).tobytes(),
+          scan["block_class"].astype(np.uint8).tobytes(),
+          scan["block_bytes"].astype(np.uint32).tobytes(),
+          battery["sxy"], battery["pairs"]))
+
+def cache_evict(conn, max_bytes=HISTOGRAM_CACHE_MAX_BYTES):
+    """
+    Drops least recently used entries until the cache holds at most max_bytes.
+    """
+    total = conn.execute(
+        f"SELECT COALESCE(SUM({CACHE_ENTRY_BYTES}), 0) FROM extent_histograms"
+    ).fetchone()[0]
+    if total <= max_bytes:
+        return 0
+    evicted = 0
+    rows = conn.execute(f"""
+        SELECT rowid, {CACHE_ENTRY_BYTES}
+        FROM extent_histograms
+        ORDER BY last_used ASC
+    """).fetchall()
+    for rowid, entry_bytes in rows:
+        if total <= max_bytes:
+            break
+        conn.execute("DELETE FROM extent_histograms WHERE rowid=?", (rowid,))
+        total -= entry_bytes
+        evicted += 1
+    return evicted
+
+def cached_byte_histogram(raw_files, chunk_size=CHUNK_SIZE, workers=HISTOGRAM_WORKERS,
+                          split_size=SPLIT_SIZE, block_size=BLOCK_SIZE,
+                          cache_db=HISTOGRAM_CACHE_DB, max_bytes=HISTOGRAM_CACHE_MAX_BYTES):
+    """
+    stream_byte_histogram with a persistent cache keyed by
+    (path, size, mtime, block_size). Only uncached extents are read.
+    """
+    try:
+        conn = open_histogram_cache(cache_db)
+    except sqlite3.Error as e:
+        print(f"[WARNING] Histogram cache unavailable ({e}); scanning all extents.")
+        return stream_byte_histogram(raw_files, chunk_size, workers, split_size, block_size)
 
-    print("\n[INFO] /backup/tmp/ contents:\n")
     try:
-        subprocess.run(["ls", "-lh", "/backup/tmp"], check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"[ERROR] listing /backup/tmp: {e}")
+        per_file = {}
+        stats = {}
+        misses = []
+        for path in raw_files:
+            try:
+                stats[path] = os.stat(path)
+            except OSError as e:
+                print(f"[ERROR] Reading {path}: {e}")
+                continue
+            hit = cache_lookup(conn, path, stats[path], block_size)
+            if hit is None:
+                misses.append(path)
+            else:
+                per_file[path] = hit
+        print(f"[INFO] Histogram cache: {len(per_file)} hit(s), {len(misses)} miss(es).")
+
+        if misses:
+            scanned = histogram_files(misses, chunk_size, workers, split_size, block_size)
+            for path, scan in scanned.items():
+                per_file[path] = scan
+                # only cache if the extent did not change while we read it
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if (st.st_size, st.st_mtime_ns) == (stats[path].st_size, stats[path].st_mtime_ns):
+                    cache_store(conn, path, st, scan, block_size)
+            cache_evict(conn, max_bytes)
+        conn.commit()
+    finally:
+        conn.close()
 
-    return copied_files
+    return merge_file_histograms(raw_files, per_file)
+
+def byte_entropy_from_histogram(freq):
+    total = freq.sum()
+    if total == 0:
+        return 0.0
+    probs = freq/total
+    nz = probs[probs>0]
+    return float(-np.sum(nz*np.log2(nz)))
+
+def chi_square_from_histogram(freq):
+    total = freq.sum()
+    if total == 0:
+        return 0.0
+    expected = total/256.0
+    return float(np.sum((freq-expected)**2 / expected))
 
 ##############################
-# 3) LENGTH-BASED ANALYSIS
+# 2c) PER-BLOCK ENTROPY MAP
+##############################
+ENTROPY_MAP_DIR = os.environ.get("ASPAR_ENTROPY_MAP_DIR", "/backup/entropy_maps")
+HIGH_ENTROPY_BITS = 7.9
+
+def entropy_map_summary(block_map, threshold=HIGH_ENTROPY_BITS):
+    """
+    Quantiles of the block entropy map and the fraction of blocks above
+    threshold bits/byte.
+    """
+    if len(block_map) == 0:
+        return {"block_entropy_p50": 0.0, "block_entropy_p95": 0.0,
+                "block_entropy_p99": 0.0, "high_entropy_fraction": 0.0}
+    p50, p95, p99 = np.quantile(block_map, [0.50, 0.95, 0.99])
+    return {
+        "block_entropy_p50": float(p50),
+        "block_entropy_p95": float(p95),
+        "block_entropy_p99": float(p99),
+        "high_entropy_fraction": float(np.mean(block_map > threshold)),
+    }
+
+def save_entropy_map(sanitized_vm_id, checkpoint, block_map):
+    """
+    Stores the block entropy map as a float16 .npy file per checkpoint:
+    {ENTROPY_MAP_DIR}/{vm}/{checkpoint}.npy
+    """
+    try:
+        vm_dir = os.path.join(ENTROPY_MAP_DIR, sanitized_vm_id)
+        os.makedirs(vm_dir, exist_ok=True)
+        map_file = os.path.join(vm_dir, f"{checkpoint or 'latest'}.npy")
+        np.save(map_file, block_map.astype(np.float16))
+        print(f"[INFO] Entropy map ({len(block_map)} blocks) saved to {map_file}")
+        return map_file
+    except OSError as e:
+        print(f"[ERROR] save_entropy_map: {e}")
+        return None
+
 ##############################
-def calculate_entropy(values):
-    prob = pd.Series(values).value_counts(normalize=True)
-    return -np.sum(prob * np.log2(prob))
+# 2c-1) BASELINE DRIFT
+##############################
+# Per VM and disk, an exponentially weighted 256-bin byte distribution of
+# past checkpoints is kept in aspar.db (byte_baselines). Each new
+# checkpoint is compared against it (KL and Jensen-Shannon divergence)
+# before being folded in, so a sudden change in write pattern shows up
+# even when the data is not close to uniform.
+BASELINE_ALPHA = 0.2        # weight of the newest checkpoint
+BASELINE_PSEUDOCOUNT = 1e-6  # keeps KL finite for bytes never seen
+
+def open_baselines():
+    conn = sqlite3.connect(ASPAR_DB)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS byte_baselines (
+            vm_id TEXT,
+            disk_id TEXT,
+            histogram BLOB,
+            previous_histogram BLOB,
+            checkpoints INTEGER,
+            last_checkpoint TEXT,
+            updated_at TEXT,
+            PRIMARY KEY (vm_id, disk_id)
+        )
+    """)
+    return conn
+
+def byte_distribution(freq, pseudocount=BASELINE_PSEUDOCOUNT):
+    p = np.asarray(freq, dtype=np.float64) + pseudocount
+    return p / p.sum()
+
+def byte_divergences(p, q):
+    """
+    KL(p || q) and Jensen-Shannon divergence in bits of two smoothed
+    256-bin distributions. JS is symmetric and bounded by 1.
+    """
+    m = 0.5 * (p + q)
+    kl = float(np.sum(p * np.log2(p / q)))
+    js = float(0.5*np.sum(p * np.log2(p / m)) + 0.5*np.sum(q * np.log2(q / m)))
+    return {"kl_divergence": max(kl, 0.0), "js_divergence": max(js, 0.0)}
+
+def update_byte_baseline(vm_id_input, disk_id, freq, checkpoint, alpha=BASELINE_ALPHA):
+    """
+    Divergence of this checkpoint's byte distribution from the VM/disk
+    baseline, then the baseline update. The first checkpoint only seeds the
+    baseline (divergences 0). Re-running the last checkpoint compares it with
+    the baseline it was folded into and does not fold it in twice.
+    """
+    p = byte_distribution(freq)
+    result = {"kl_divergence": 0.0, "js_divergence": 0.0}
+    conn = open_baselines()
+    try:
+        key = (vm_id_input, disk_id or "")
+        row = conn.execute("""
+            SELECT histogram, previous_histogram, checkpoints, last_checkpoint FROM byte_baselines
+            WHERE vm_id=? AND disk_id=?
+        """, key).fetchone()
+        if row is not None and checkpoint is not None and checkpoint == row[3]:
+            if row[1] is not None:
+                result = byte_divergences(p, np.frombuffer(row[1], dtype=np.float64))
+            return result
+        if row is None:
+            previous, baseline, seen = None, p, 1
+        else:
+            previous = np.frombuffer(row[0], dtype=np.float64)
+            result = byte_divergences(p, previous)
+            baseline, seen = (1 - alpha)*previous + alpha*p, row[2] + 1
+        conn.execute("""
+            INSERT OR REPLACE INTO byte_baselines
+                (vm_id, disk_id, histogram, previous_histogram, checkpoints, last_checkpoint, updated_at)
+            VALUES (?,?,?,?,?,?,?)
+        """, (*key, baseline.tobytes(), None if previous is None else previous.tobytes(), seen, checkpoint,
+              datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        conn.commit()
+    finally:
+        conn.close()
+    return result
+
+##############################
+# 2d) SAMPLED BYTE ENTROPY
+##############################
+# Incrementals with more dirty data than this are sampled instead of scanned
+SAMPLE_THRESHOLD_BYTES = int(os.environ.get("ASPAR_SAMPLE_THRESHOLD", 1024**4))
+SAMPLE_BLOCK_SIZE = 64 * 1024
+SAMPLE_BATCH_BLOCKS = 256          # blocks read between convergence checks
+SAMPLE_MIN_BLOCKS = 1024
+SAMPLE_MAX_BLOCKS = 256 * 1024     # 16 GiB of 64 KiB blocks
+SAMPLE_CONFIDENCE = 0.95
+SAMPLE_ENTROPY_TOLERANCE = 0.01    # CI half-width, bits/byte
+SAMPLE_CHI_SQUARE_TOLERANCE = 0.05 # CI half-width, relative to the estimate
+SAMPLE_TIME_BUDGET = 120.0         # seconds
+
+def get_dirty_extents(vm_id_input, checkpoint):
+    """
+    (Start, Length) of the dirty extents recorded for checkpoint in
+    incremental_{vm_id_input}.
+    """
+    sanitized_vm_id = vm_id_input.replace('-', '')
+    conn = sqlite3.connect(BACKUP_INDEX_DB)
+    extents = []
+    try:
+        # cast by SQLite, like load_incremental_arrays
+        extents = conn.execute(f"""
+            SELECT CAST(Start AS INTEGER), CAST(Length AS INTEGER) FROM "incremental_{sanitized_vm_id}"
+            WHERE Checkpoint = ? AND lower(trim(Dirty)) = 'true'
+              AND trim(Start) != '' AND trim(Start) NOT GLOB '*[^0-9]*'
+              AND trim(Length) != '' AND trim(Length) NOT GLOB '*[^0-9]*'
+        """, (checkpoint,)).fetchall()
+    except Exception as e:
+        print(f"[ERROR] get_dirty_extents: {e}")
+    finally:
+        conn.close()
+    return extents
+
+def dirty_extent_files(raw_files, extents):
+    """
+    Matches dirty extents to their {vm}_{Start}_{Length}.raw files.
+    Returns [(path, size)]; falls back to every raw file when the
+    incremental table has no matching rows.
+    """
+    by_range = {}
+    for path in raw_files:
+        parts = os.path.splitext(os.path.basename(path))[0].rsplit('_', 2)
+        if len(parts) == 3:
+            by_range[(parts[1], parts[2])] = path
+    matched = []
+    for start, length in extents:
+        path = by_range.get((str(start), str(length)))
+        if path:
+            matched.append((path, min(length, os.path.getsize(path))))
+    if not matched:
+        matched = [(path, os.path.getsize(path)) for path in raw_files]
+    return matched
+
+def sample_byte_entropy(extent_files, block_size=SAMPLE_BLOCK_SIZE,
+                        confidence=SAMPLE_CONFIDENCE,
+                        entropy_tolerance=SAMPLE_ENTROPY_TOLERANCE,
+                        chi_square_tolerance=SAMPLE_CHI_SQUARE_TOLERANCE,
+                        min_blocks=SAMPLE_MIN_BLOCKS, max_blocks=SAMPLE_MAX_BLOCKS,
+                        time_budget=SAMPLE_TIME_BUDGET, seed=None):
+    """
+    Estimates byte entropy and chi-square from randomly chosen, aligned
+    blocks of the dirty extents, drawn without replacement until both
+    confidence intervals are within tolerance (or the block/time budget
+    runs out).
+
+    Blocks are treated as clusters: the pooled byte proportions are a ratio
+    estimator, and the CI half-widths come from the delta method with a
+    finite population correction, plus the second-order term that
+    dominates near uniform bytes (where the first-order gradients vanish).
+    The entropy is corrected for the second-order bias of the plug-in
+    estimate, which near uniform bytes is larger than the CI itself.
+
+    chi_square is scaled to the population like a full scan: the sampling
+    noise in sum((p-1/256)^2) is subtracted once, which leaves an estimate of
+    the full-scan value (including its ~255 multinomial floor for random
+    bytes). That floor cannot be narrowed by sampling, so the chi-square
+    tolerance counts as met once the sample is consistent with uniform bytes.
+    """
+    sizes = np.array([size for _, size in extent_files], dtype=np.int64)
+    blocks_per_file = (sizes + block_size - 1) // block_size
+    first_block = np.concatenate([[0], np.cumsum(blocks_per_file)])
+    n_population = int(first_block[-1])
+    population_bytes = int(sizes.sum())
+    z = NormalDist().inv_cdf(0.5 + confidence/2)
+    # Wilson-Hilferty upper quantile of chi2 with 255 degrees of freedom
+    k = 255
+    uniform_chi2_limit = k * (1 - 2/(9*k) + NormalDist().inv_cdf(confidence) * np.sqrt(2/(9*k)))**3
+
+    result = {"byte_entropy": 0.0, "chi_square": 0.0, "byte_entropy_ci": 0.0,
+              "chi_square_ci": 0.0, "sample_blocks": 0, "sampled_bytes": 0,
+              "population_bytes": population_bytes, "confidence": confidence,
+              "block_map": np.zeros(0, dtype=np.float32),
+              "freq": np.zeros(256, dtype=np.int64), "battery": battery_state(),
+              "compress_ratios": np.zeros(0, dtype=np.float32),
+              "block_class": np.zeros(0, dtype=np.uint8),
+              "block_bytes": np.zeros(0, dtype=np.uint32)}
+    if n_population == 0:
+        return result
+
+    rng = np.random.default_rng(seed)
+    order = rng.choice(n_population, size=min(n_population, max_blocks), replace=False)
+
+    counts = []
+    lengths = []
+    ratios = []
+    magic = []
+    fds = {}
+    buf = aligned_buffer(block_size)
+    started = time.monotonic()
+    try:
+        for batch_start in range(0, len(order), SAMPLE_BATCH_BLOCKS):
+            # read each batch in file/offset order
+            batch = np.sort(order[batch_start:batch_start + SAMPLE_BATCH_BLOCKS])
+            file_idx = np.searchsorted(first_block, batch, side='right') - 1
+            for b, fi in zip(batch, file_idx):
+                path, size = extent_files[fi]
+                offset = int(b - first_block[fi]) * block_size
+                if path not in fds:
+                    fds[path] = open_extent(path)
+                fd, direct = fds[path]
+                if READ_MODE == "buffered":
+                    data = np.frombuffer(os.pread(fd, min(block_size, size - offset), offset), dtype=np.uint8)
+                else:
+                    data = buf[:pread_into(fd, buf, min(block_size, size - offset), offset, direct)]
+                counts.append(np.bincount(data, minlength=256))
+                lengths.append(len(data))
+                battery_update(result["battery"], data, contiguous=False)
+                magic.append(block_magic_hits(data, block_size, offset).any())
+                if len(lengths) % COMPRESS_SAMPLE_STRIDE == 1:
+                    piece = data[:COMPRESS_SAMPLE_BYTES]
+                    ratios.append(len(zlib.compress(piece, COMPRESS_LEVEL)) / len(piece))
+
+            n = len(counts)
+            c = np.array(counts, dtype=np.float64)
+            m = np.array(lengths, dtype=np.float64)
+            p = c.sum(axis=0) / m.sum()
+
+            # delta-method gradients of H(p) and chi2(p) = T*256*sum((p-1/256)^2)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                grad_h = np.where(p > 0, -(np.log2(p) + 1/np.log(2)), 0.0)
+                curv_h = np.where(p > 0, 1 / (2 * p * np.log(2)), 0.0)
+            grad_chi = population_bytes * 256 * 2 * (p - 1/256.0)
+            resid = (c - m[:, None]*p) / m.mean()
+            fpc = 1 - n/n_population
+            # per-byte-value sampling variance of p
+            var_p = fpc * np.var(resid, axis=0, ddof=1) / n if n >= 2 else np.full(256, np.inf)
+            def half_width(grad, curvature):
+                if n < 2:
+                    return float('inf')
+                first = fpc * np.var(resid @ grad, ddof=1) / n
+                second = 2 * np.sum((curvature * var_p)**2)
+                return float(z * np.sqrt(first + second))
+
+            nz = p[p > 0]
+            deviation = np.sum((p - 1/256.0)**2)
+            noise = float(np.sum(var_p)) if n >= 2 else deviation
+            sample_chi2 = float(m.sum() * 256 * deviation)
+            # the plug-in entropy of a sample is biased low by about
+            # sum(curv_h * var_p), which exceeds the CI near uniform bytes
+            entropy_bias = float(np.sum(curv_h * var_p)) if n >= 2 else 0.0
+            result["byte_entropy"] = float(-np.sum(nz*np.log2(nz))) + entropy_bias
+            result["chi_square"] = float(population_bytes * 256 * max(deviation - noise, 0.0))
+            result["byte_entropy_ci"] = half_width(grad_h, curv_h)
+            result["chi_square_ci"] = half_width(grad_chi, population_bytes * 256)
+            result["sample_blocks"] = n
+            result["sampled_bytes"] = int(m.sum())
+
+            chi_square_settled = (result["chi_square_ci"] <= chi_square_tolerance * max(result["chi_square"], 1.0)
+                                  or sample_chi2 <= uniform_chi2_limit)
+            converged = result["byte_entropy_ci"] <= entropy_tolerance and chi_square_settled
+            if n >= min(min_blocks, n_population) and converged:
+                break
+            if time.monotonic() - started > time_budget:
+                print(f"[WARNING] Sampling time budget ({time_budget}s) reached before convergence.")
+                break
+    finally:
+        for fd, _ in fds.values():
+            os.close(fd)
+
+    if counts:
+        counts = np.array(counts, dtype=np.int64)
+        lengths = np.array(lengths, dtype=np.int64)
+        result["block_map"] = block_entropies(counts, lengths)
+        result["block_class"] = classify_blocks(counts, lengths, result["block_map"],
+                                                np.array(magic, dtype=bool))
+        result["block_bytes"] = lengths.astype(np.uint32)
+        result["freq"] = counts.sum(axis=0)
+        result["compress_ratios"] = np.array(ratios, dtype=np.float32)
+    return result
 
-def process_data(df):
+##############################
+# 3) LENGTH-BASED ANALYSIS
+##############################
+def clean_incremental_df(df):
     df['Dirty'] = df['Dirty'].astype(str).str.lower().map({'true': True, 'false': False})
     df['Zero'] = df['Zero'].astype(str).str.lower().map({'true': True, 'false': False})
     df['Length'] = pd.to_numeric(df['Length'], errors='coerce')
     df['Start'] = pd.to_numeric(df['Start'], errors='coerce')
     df.dropna(subset=['Length','Start'], inplace=True)
+    return df
 
-    total_size = df["Length"].sum() or 0
-    mean_block_size = df["Length"].mean() or 0
-    variance = df["Length"].var() or 0
-    std_deviation = df["Length"].std() or 0
-    zeroed_block_ratio = 0.0
-    dirty_block_ratio = 0.0
-    if total_size>0:
-        zeroed_block_ratio = df[df["Zero"]]["Length"].sum()/total_size
-        dirty_block_ratio = df[df["Dirty"]]["Length"].sum()/total_size
-
-    length_entropy = 0.0
-    if not df.empty:
-        length_entropy = calculate_entropy(df["Length"])
-
-    return (
-        length_entropy,     # 0
-        mean_block_size,    # 1
-        variance,           # 2
-        std_deviation,      # 3
-        zeroed_block_ratio, # 4
-        dirty_block_ratio   # 5
-    )
-
+# share of the dirty-ratio weight dropped for dirty data in a known compressed format
+KNOWN_COMPRESSED_DISCOUNT = 0.5
 
 def weighted_entropy_score(shannon_entropy_length, mean_block_size, variance,
                            std_deviation, zeroed_block_ratio, dirty_block_ratio,
-                           cpu_usage, mem_free_kb, mem_used_kb):
+                           cpu_usage, mem_free_kb, mem_used_kb, content=None):
+    """
+    content is the content_summary of the checkpoint's dirty extents, when
+    they were scanned. Dirty blocks that hold a recognised compressed format
+    then count for less.
+    """
     # Updated weights
     w_dirty_block_ratio   = 0.85
     w_shannon_entropy     = 0.05
@@ -217,6 +1657,10 @@ def weighted_entropy_score(shannon_entropy_length, mean_block_size, variance,
     w_cpu_usage           = 0.01
     w_swap_used           = 0.005
     w_mem_free_inverse    = 0.005
+    # the weights do not depend on whether content was scanned, so scores
+    # stay comparable across runs; content only discounts the dirty ratio
+    if content is not None:
+        dirty_block_ratio *= 1.0 - KNOWN_COMPRESSED_DISCOUNT * content["known_compressed_fraction"]
 
     # Normalized inputs
     normalized_shannon = shannon_entropy_length / 8 if shannon_entropy_length > 0 else 0
@@ -244,6 +1688,256 @@ def weighted_entropy_score(shannon_entropy_length, mean_block_size, variance,
 
 
 
+##############################
+# 3a) TYPED INCREMENTAL LOADER
+##############################
+# Checkpointed rows of incremental_{vm} as typed columns, cast by SQLite.
+# Rows are only fetched for checkpoints the caller has not seen yet.
+def _empty_incremental_arrays():
+    return {
+        "start": np.zeros(0, dtype=np.int64),
+        "length": np.zeros(0, dtype=np.int64),
+        "dirty": np.zeros(0, dtype=bool),
+        "zero": np.zeros(0, dtype=bool),
+        "checkpoint_idx": np.zeros(0, dtype=np.int32),
+        "checkpoints": np.zeros(0, dtype=str),
+        "recorded_at": np.zeros(0, dtype=str),
+    }
+
+def load_incremental_arrays(vm_id_input, conn=None, skip_checkpoints=()):
+    """
+    Typed columns of the checkpointed incremental rows:
+    start/length (int64), dirty/zero (bool), checkpoint_idx (int32 index
+    into checkpoints) and recorded_at (first Date Time per checkpoint).
+    Rows whose Start or Length is not an integer are dropped, and so are
+    the checkpoints in skip_checkpoints (to read only the rows of
+    checkpoints not seen before).
+    """
+    sanitized_vm_id = vm_id_input.replace('-', '')
+    incremental_table = f"incremental_{sanitized_vm_id}"
+    arrays = _empty_incremental_arrays()
+
+    own_conn = conn is None
+    if own_conn:
+        conn = sqlite3.connect(BACKUP_INDEX_DB)
+    try:
+        conn.execute(f"""
+            CREATE INDEX IF NOT EXISTS idx_{incremental_table}_checkpoint
+            ON {incremental_table}(Checkpoint)
+        """)
+        # DISTINCT is answered from the index; rows are only touched for
+        # the checkpoints that are actually new
+        skip = set(skip_checkpoints)
+        new = [cp for (cp,) in conn.execute(f"""
+            SELECT DISTINCT Checkpoint FROM {incremental_table}
+            WHERE Checkpoint IS NOT NULL
+        """) if cp not in skip]
+        if not new:
+            return arrays
+
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS new_checkpoints (idx INTEGER, Checkpoint TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM new_checkpoints")
+        conn.executemany("INSERT INTO new_checkpoints (idx, Checkpoint) VALUES (?,?)",
+                         list(enumerate(new)))
+        recorded_at = dict(conn.execute(f"""
+            SELECT i.Checkpoint, MIN(i.Date || ' ' || i.Time)
+            FROM {incremental_table} i JOIN new_checkpoints n ON i.Checkpoint = n.Checkpoint
+            GROUP BY i.Checkpoint
+        """).fetchall())
+        new = [(cp, recorded_at.get(cp)) for cp in new]
+        rows = conn.execute(f"""
+            SELECT CAST(i.Start AS INTEGER), CAST(i.Length AS INTEGER),
+                   lower(trim(i.Dirty)) = 'true', lower(trim(i.Zero)) = 'true', n.idx
+            FROM {incremental_table} i JOIN new_checkpoints n ON i.Checkpoint = n.Checkpoint
+            WHERE trim(i.Start) != '' AND trim(i.Start) NOT GLOB '*[^0-9]*'
+              AND trim(i.Length) != '' AND trim(i.Length) NOT GLOB '*[^0-9]*'
+        """).fetchall()
+    finally:
+        if own_conn:
+            conn.close()
+
+    fresh = np.array(rows, dtype=np.int64).reshape(-1, 5)
+    return {
+        "start": fresh[:, 0],
+        "length": fresh[:, 1],
+        "dirty": fresh[:, 2].astype(bool),
+        "zero": fresh[:, 3].astype(bool),
+        "checkpoint_idx": fresh[:, 4].astype(np.int32),
+        "checkpoints": np.array([cp for cp, _ in new]),
+        "recorded_at": np.array([at or "" for _, at in new]),
+    }
+
+##############################
+# 3b) LENGTH SUFFICIENT STATISTICS
+##############################
+# Per-checkpoint (count, sum, M2, zero/dirty bytes) in length_stats_{vm} and
+# the Length value histogram in length_hist_{vm}, both in Backup_Index.db.
+# Only checkpoints without stats are computed; the metrics are then combined
+# in O(#checkpoints). LENGTH_STATS_WINDOW limits them to the last N.
+LENGTH_STATS_WINDOW = None
+
+def read_incremental_df(vm_id_input, checkpoints=None, conn=None):
+    """
+    Raw incremental rows (all checkpointed rows, or only those of
+    checkpoints) as the TEXT-typed dataframe stored by incrementalSource.
+    """
+    sanitized_vm_id = vm_id_input.replace('-', '')
+    own_conn = conn is None
+    if own_conn:
+        conn = sqlite3.connect(BACKUP_INDEX_DB)
+    try:
+        if checkpoints is None:
+            return pd.read_sql(f"""
+                SELECT Start,Length,Dirty,Zero,Date,Time,Checkpoint
+                FROM "incremental_{sanitized_vm_id}"
+                WHERE Checkpoint IS NOT NULL
+            """, conn)
+        marks = ",".join("?" * len(checkpoints))
+        return pd.read_sql(f"""
+            SELECT Start,Length,Dirty,Zero,Date,Time,Checkpoint
+            FROM "incremental_{sanitized_vm_id}"
+            WHERE Checkpoint IN ({marks})
+        """, conn, params=list(checkpoints))
+    finally:
+        if own_conn:
+            conn.close()
+
+def update_length_stats(vm_id_input):
+    """
+    Records sufficient statistics for every checkpoint in incremental_{vm}
+    that has none yet. Returns the number of checkpoints added.
+    """
+    sanitized_vm_id = vm_id_input.replace('-', '')
+    stats_table = f"length_stats_{sanitized_vm_id}"
+    hist_table = f"length_hist_{sanitized_vm_id}"
+
+    conn = sqlite3.connect(BACKUP_INDEX_DB)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {stats_table} (
+                Checkpoint TEXT PRIMARY KEY,
+                recorded_at TEXT,
+                n INTEGER,
+                sum_length REAL,
+                m2_length REAL,
+                zero_length REAL,
+                dirty_length REAL
+            )
+        """)
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {hist_table} (
+                Checkpoint TEXT,
+                Length INTEGER,
+                Count INTEGER,
+                PRIMARY KEY (Checkpoint, Length)
+            )
+        """)
+        existing = {row[0] for row in cursor.execute(f"SELECT Checkpoint FROM {stats_table}")}
+        # only the rows of checkpoints without stats are read
+        arrays = load_incremental_arrays(vm_id_input, conn=conn, skip_checkpoints=existing)
+        new_idx = np.arange(len(arrays["checkpoints"]), dtype=np.int64)
+        if len(new_idx) == 0:
+            return 0
+
+        # per-checkpoint sums in one bincount each
+        n_cp = len(arrays["checkpoints"])
+        idx = arrays["checkpoint_idx"]
+        length = arrays["length"].astype(np.float64)
+        n_k = np.bincount(idx, minlength=n_cp)
+        sum_k = np.bincount(idx, weights=length, minlength=n_cp)
+        mean_k = np.divide(sum_k, n_k, out=np.zeros_like(sum_k), where=n_k > 0)
+        m2_k = np.bincount(idx, weights=(length - mean_k[idx])**2, minlength=n_cp)
+        zero_k = np.bincount(idx, weights=length * arrays["zero"], minlength=n_cp)
+        dirty_k = np.bincount(idx, weights=length * arrays["dirty"], minlength=n_cp)
+
+        cursor.executemany(f"""
+            INSERT OR REPLACE INTO {stats_table}
+                (Checkpoint, recorded_at, n, sum_length, m2_length, zero_length, dirty_length)
+            VALUES (?,?,?,?,?,?,?)
+        """, [(str(arrays["checkpoints"][i]), str(arrays["recorded_at"][i]) or None, int(n_k[i]),
+               float(sum_k[i]), float(m2_k[i]), float(zero_k[i]), float(dirty_k[i])) for i in new_idx])
+
+        pairs, counts = np.unique(
+            np.stack([idx.astype(np.int64), arrays["length"]], axis=1),
+            axis=0, return_counts=True)
+        cursor.executemany(f"""
+            INSERT OR REPLACE INTO {hist_table} (Checkpoint, Length, Count) VALUES (?,?,?)
+        """, [(str(arrays["checkpoints"][i]), int(v), int(c)) for (i, v), c in zip(pairs, counts)])
+        conn.commit()
+        print(f"[INFO] Recorded length statistics for {len(new_idx)} new checkpoint(s).")
+        return len(new_idx)
+    finally:
+        conn.close()
+
+def load_length_stats(vm_id_input, window=LENGTH_STATS_WINDOW):
+    """
+    Combines the per-checkpoint statistics (all, or the last window
+    checkpoints) into one dict: n, mean, m2, total, zero, dirty, hist_counts.
+    """
+    sanitized_vm_id = vm_id_input.replace('-', '')
+    stats_table = f"length_stats_{sanitized_vm_id}"
+    hist_table = f"length_hist_{sanitized_vm_id}"
+
+    conn = sqlite3.connect(BACKUP_INDEX_DB)
+    try:
+        limit = f"LIMIT {int(window)}" if window else ""
+        rows = conn.execute(f"""
+            SELECT Checkpoint, n, sum_length, m2_length, zero_length, dirty_length
+            FROM {stats_table}
+            ORDER BY recorded_at DESC
+            {limit}
+        """).fetchall()
+        checkpoints = [row[0] for row in rows]
+        hist_counts = np.zeros(0, dtype=np.int64)
+        if checkpoints:
+            marks = ",".join("?" * len(checkpoints))
+            hist_counts = np.array([row[0] for row in conn.execute(f"""
+                SELECT SUM(Count) FROM {hist_table}
+                WHERE Checkpoint IN ({marks})
+                GROUP BY Length
+            """, checkpoints)], dtype=np.int64)
+    finally:
+        conn.close()
+
+    if not rows:
+        return {"n": 0, "mean": 0.0, "m2": 0.0, "total": 0.0, "zero": 0.0,
+                "dirty": 0.0, "hist_counts": hist_counts}
+    arr = np.array([row[1:] for row in rows], dtype=np.float64)
+    n_k, sum_k, m2_k, zero_k, dirty_k = arr.T
+    n = n_k.sum()
+    mean = sum_k.sum() / n if n else 0.0
+    # Chan et al. pairwise combination of the per-checkpoint M2
+    mean_k = np.divide(sum_k, n_k, out=np.zeros_like(sum_k), where=n_k > 0)
+    m2 = m2_k.sum() + np.sum(n_k * (mean_k - mean)**2)
+    return {"n": int(n), "mean": float(mean), "m2": float(m2), "total": float(sum_k.sum()),
+            "zero": float(zero_k.sum()), "dirty": float(dirty_k.sum()),
+            "hist_counts": hist_counts}
+
+def length_metrics_from_stats(stats):
+    """
+    (length_entropy, mean_block_size, variance, std_deviation,
+    zeroed_block_ratio, dirty_block_ratio) from combined sufficient
+    statistics.
+    """
+    n = stats["n"]
+    if n == 0:
+        return (0.0, 0, 0, 0, 0.0, 0.0)
+    variance = stats["m2"] / (n - 1) if n > 1 else 0
+    total_size = stats["total"]
+    zeroed_block_ratio = stats["zero"]/total_size if total_size > 0 else 0.0
+    dirty_block_ratio = stats["dirty"]/total_size if total_size > 0 else 0.0
+    prob = stats["hist_counts"] / stats["hist_counts"].sum()
+    length_entropy = float(0.0 - np.sum(prob * np.log2(prob)))
+    return (
+        length_entropy,          # 0
+        stats["mean"],           # 1
+        variance,                # 2
+        float(np.sqrt(variance)),# 3
+        zeroed_block_ratio,      # 4
+        dirty_block_ratio        # 5
+    )
+
 ##############################
 # 4) R COMPARISON
 ##############################
@@ -255,6 +1949,79 @@ def run_r_script(input_file):
         print(f"[ERROR] R script: {e}")
         return None
 
+def parse_r_output(r_output):
+    r_metrics = {}
+    if r_output:
+        for line in r_output.split('\n'):
+            if ":" in line:
+                parts=line.split(':',1)
+                if len(parts)==2:
+                    key,val=parts
+                    key=key.strip()
+                    val=val.strip()
+                    try:
+                        r_metrics[key]=float(val)
+                    except:
+                        pass
+    return r_metrics
+
+# "native" computes the ransomware_analysis.R metrics in-process;
+# "rscript" still exports the CSV and runs Rscript.
+R_ENGINE = os.environ.get("ASPAR_R_ENGINE", "native")
+
+def signif(value, digits):
+    # R's format(x, scientific=TRUE, digits=n)
+    return float(f"{value:.{digits-1}e}")
+
+def r_metrics_native(length_metrics, row_count):
+    """
+    Port of /root/ransomware_analysis.R on the length metrics (tuple of
+    length_metrics_from_stats), including its consensus-weighted score. Values are
+    rounded the way the R script prints them; keys match its output lines.
+    """
+    if row_count == 0:
+        return {}
+    (shannon_entropy_length, mean_block_size, variance, std_deviation,
+     zeroed_block_ratio, dirty_block_ratio) = [float(v) for v in length_metrics]
+
+    r_metrics = {
+        "Shannon Entropy (Length)": round(shannon_entropy_length, 5),
+        "Mean Block Size": round(mean_block_size, 5),
+        "Zeroed Block Ratio": round(zeroed_block_ratio, 5),
+        "Dirty Block Ratio": round(dirty_block_ratio, 5),
+    }
+    # var()/sd() are NA for a single row, and so is the weighted score
+    if row_count < 2:
+        return r_metrics
+
+    # Consensus weights
+    w_shannon_entropy    = 0.35
+    w_dirty_block_ratio  = 0.28
+    w_zeroed_block_ratio = 0.15
+    w_variance           = 0.10
+    w_std_deviation      = 0.10
+    w_mean_block_size    = 0.05
+
+    # each metric is a scalar, so x / max(x) is 1 (or NaN for 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        normalized_mean_block_size = np.float64(mean_block_size) / np.float64(mean_block_size)
+        normalized_variance = np.float64(variance) / np.float64(variance)
+        normalized_std_dev = np.float64(std_deviation) / np.float64(std_deviation)
+
+    entropy_score = round(float(
+        (w_shannon_entropy * shannon_entropy_length / 8) +
+        (w_dirty_block_ratio * dirty_block_ratio) +
+        (w_zeroed_block_ratio * zeroed_block_ratio) +
+        (w_variance * normalized_variance) +
+        (w_std_deviation * normalized_std_dev) +
+        (w_mean_block_size * normalized_mean_block_size)
+    ), 5)
+
+    r_metrics["Variance"] = signif(variance, 5)
+    r_metrics["Standard Deviation"] = round(std_deviation, 5)
+    r_metrics["Weighted Entropy Score"] = entropy_score
+    return r_metrics
+
 def calculate_average(val1, val2):
     from decimal import Decimal, ROUND_HALF_UP
     try:
@@ -274,6 +2041,289 @@ def calculate_average(val1, val2):
 ##############################
 # 5) DB STORAGE
 ##############################
+# Columns added after the original schema; missing ones are ALTERed in.
+EXTRA_METRIC_COLUMNS = [
+    ("block_entropy_p50", "REAL"),
+    ("block_entropy_p95", "REAL"),
+    ("block_entropy_p99", "REAL"),
+    ("high_entropy_fraction", "REAL"),
+    ("sampled_bytes", "INTEGER"),
+    ("byte_entropy_ci", "REAL"),
+    ("chi_square_ci", "REAL"),
+    ("arithmetic_mean", "REAL"),
+    ("serial_correlation", "REAL"),
+    ("monte_carlo_pi", "REAL"),
+    ("bigram_entropy", "REAL"),
+    ("compress_ratio_mean", "REAL"),
+    ("compress_ratio_p10", "REAL"),
+    ("compress_ratio_p50", "REAL"),
+    ("compress_ratio_p90", "REAL"),
+    ("incompressible_fraction", "REAL"),
+    ("known_compressed_bytes", "INTEGER"),
+    ("text_bytes", "INTEGER"),
+    ("unknown_high_entropy_bytes", "INTEGER"),
+    ("kl_divergence", "REAL"),
+    ("js_divergence", "REAL"),
+]
+
+def ensure_columns(cursor, table_name, columns):
+    cursor.execute(f"PRAGMA table_info({table_name})")
+    existing = {row[1] for row in cursor.fetchall()}
+    for name, col_type in columns:
+        if name not in existing:
+            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {name} {col_type}")
+
+##############################
+# 5a) RESULT WRITER
+##############################
+# One long-lived connection per process writes the entropy score rows.
+# aspar.db is switched to WAL so the ML cron job and the shell scripts can
+# keep reading while we write (and the reverse). All VMs share one
+# entropy_scores table indexed by (vm_id, timestamp); the old per-VM
+# entropy_scores_<vm> tables are migrated into it on first write (or with
+# --migrate-scores) and replaced by views, so existing readers keep working.
+# sqlite3 keeps the single INSERT prepared on the connection. run_batch()
+# queues rows and writes them in one transaction per RESULT_BATCH_ROWS.
+RESULT_DB_TIMEOUT = 30      # seconds SQLite itself waits on a lock
+RESULT_BUSY_RETRIES = 5     # further attempts after that, with backoff
+RESULT_BATCH_ROWS = 64
+
+# With ASPAR_STREAM_ANOMALY=1 (or --stream-anomaly) every written row is
+# scored right away by the streaming detector of ransomware_ML_analysis.py.
+STREAM_ANOMALY = os.environ.get("ASPAR_STREAM_ANOMALY", "0") == "1"
+
+ENTROPY_SCORE_COLUMNS = [
+    "vm_id_input", "timestamp", "entropy_score", "mean_block_size", "variance",
+    "std_deviation", "zeroed_block_ratio", "dirty_block_ratio", "shannon_entropy",
+    "delta_entropy", "byte_entropy", "chi_square", "cpu_usage", "mem_free_kb", "mem_used_kb",
+]
+
+_result_writer = None
+
+def with_busy_retry(fn, retries=RESULT_BUSY_RETRIES):
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except sqlite3.OperationalError as e:
+            message = str(e).lower()
+            if attempt == retries or ("locked" not in message and "busy" not in message):
+                raise
+            delay = 0.2 * 2**attempt
+            print(f"[WARNING] aspar.db busy ({e}); retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+def get_result_writer():
+    global _result_writer
+    if _result_writer is None:
+        conn = sqlite3.connect(ASPAR_DB, timeout=RESULT_DB_TIMEOUT)
+        with_busy_retry(lambda: conn.execute("PRAGMA journal_mode=WAL"))
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _result_writer = {"conn": conn, "insert_sql": None, "views": set(), "pending": [], "batching": False}
+        atexit.register(close_result_writer)
+    return _result_writer
+
+def canonical_vm_id(sanitized_vm_id):
+    """
+    Puts the hyphens back into a 32-hex-digit VM UUID; other IDs are
+    returned unchanged.
+    """
+    if re.fullmatch(r"[0-9a-fA-F]{32}", sanitized_vm_id):
+        s = sanitized_vm_id
+        return f"{s[:8]}-{s[8:12]}-{s[12:16]}-{s[16:20]}-{s[20:]}"
+    return sanitized_vm_id
+
+def entropy_score_columns():
+    return ENTROPY_SCORE_COLUMNS + [name for name, _ in EXTRA_METRIC_COLUMNS]
+
+def ensure_entropy_scores_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS entropy_scores (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            vm_id TEXT,
+            vm_id_input TEXT,
+            timestamp TEXT,
+            entropy_score REAL,
+            mean_block_size REAL,
+            variance REAL,
+            std_deviation REAL,
+            zeroed_block_ratio REAL,
+            dirty_block_ratio REAL,
+            shannon_entropy REAL,
+            delta_entropy REAL,
+            byte_entropy REAL,
+            chi_square REAL,
+            cpu_usage REAL,
+            mem_free_kb INTEGER,
+            mem_used_kb INTEGER
+        )
+    ''')
+    ensure_columns(conn.cursor(), "entropy_scores", EXTRA_METRIC_COLUMNS)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_entropy_scores_vm_time ON entropy_scores(vm_id, timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_entropy_scores_time ON entropy_scores(timestamp)")
+    conn.commit()
+
+def compat_view_sql(sanitized_vm_id):
+    return (f"CREATE VIEW entropy_scores_{sanitized_vm_id} AS "
+            f"SELECT id, {', '.join(entropy_score_columns())} FROM entropy_scores "
+            f"WHERE vm_id = '{canonical_vm_id(sanitized_vm_id)}'")
+
+def migrate_entropy_table(conn, sanitized_vm_id):
+    """
+    Moves the rows of a per-VM entropy_scores_<vm> table into
+    entropy_scores and replaces the table with its compatibility view, in
+    one transaction. Returns the number of rows moved.
+    The rows get new ids (every per-VM table starts at 1, so the old ids
+    cannot be kept in one table); their order is kept. The VM's
+    ransomware_anomaly_labels, keyed by the old ids, are dropped in the same
+    transaction; the ML model refits on the table -> view source change and
+    labels the rows again.
+    """
+    old_table = f"entropy_scores_{sanitized_vm_id}"
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({old_table})")}
+    columns = ", ".join(c for c in entropy_score_columns() if c in existing)
+    has_labels = conn.execute("""
+        SELECT 1 FROM sqlite_master WHERE type='table' AND name='ransomware_anomaly_labels'
+    """).fetchone() is not None
+    with conn:
+        moved = conn.execute(f"""
+            INSERT INTO entropy_scores (vm_id, {columns})
+            SELECT ?, {columns} FROM {old_table} ORDER BY id
+        """, (canonical_vm_id(sanitized_vm_id),)).rowcount
+        if has_labels:
+            conn.execute("DELETE FROM ransomware_anomaly_labels WHERE REPLACE(vmid, '-', '') = ?",
+                         (sanitized_vm_id,))
+        conn.execute(f"DROP TABLE {old_table}")
+        conn.execute(compat_view_sql(sanitized_vm_id))
+    print(f"[INFO] Migrated {moved} row(s) from {old_table} into entropy_scores.")
+    return moved
+
+def ensure_compat_view(conn, sanitized_vm_id):
+    """
+    Makes entropy_scores_<vm> a view over entropy_scores, migrating an old
+    per-VM table first and recreating a view whose column list is stale.
+    """
+    name = f"entropy_scores_{sanitized_vm_id}"
+    row = conn.execute("SELECT type, sql FROM sqlite_master WHERE name=?", (name,)).fetchone()
+    if row is not None and row[0] == "table":
+        migrate_entropy_table(conn, sanitized_vm_id)
+    elif row is None or row[1] != compat_view_sql(sanitized_vm_id):
+        with conn:
+            conn.execute(f"DROP VIEW IF EXISTS {name}")
+            conn.execute(compat_view_sql(sanitized_vm_id))
+
+def migrate_entropy_scores():
+    """
+    Migrates every per-VM entropy_scores_<vm> table in aspar.db.
+    """
+    writer = get_result_writer()
+    conn = writer["conn"]
+    with_busy_retry(lambda: ensure_entropy_scores_table(conn))
+    tables = [row[0] for row in conn.execute(r"""
+        SELECT name FROM sqlite_master
+        WHERE type='table' AND name LIKE 'entropy\_scores\_%' ESCAPE '\'
+    """)]
+    moved = 0
+    for table in tables:
+        sanitized_vm_id = table[len("entropy_scores_"):]
+        moved += with_busy_retry(lambda: migrate_entropy_table(conn, sanitized_vm_id))
+        writer["views"].add(sanitized_vm_id)
+    print(f"[INFO] Migrated {len(tables)} per-VM table(s), {moved} row(s).")
+    return moved
+
+def entropy_insert_sql(writer, sanitized_vm_id):
+    """
+    Prepares entropy_scores (once per process) and the VM's compatibility
+    view (once per VM); returns the INSERT statement.
+    """
+    conn = writer["conn"]
+    if writer["insert_sql"] is None:
+        with_busy_retry(lambda: ensure_entropy_scores_table(conn))
+        columns = ["vm_id"] + entropy_score_columns()
+        writer["insert_sql"] = (
+            f"INSERT INTO entropy_scores ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})"
+        )
+    if sanitized_vm_id not in writer["views"]:
+        with_busy_retry(lambda: ensure_compat_view(conn, sanitized_vm_id))
+        writer["views"].add(sanitized_vm_id)
+    return writer["insert_sql"]
+
+def write_entropy_rows(writer, rows):
+    """
+    Inserts [(sanitized_vm_id, values)] in one transaction.
+    """
+    statements = [(entropy_insert_sql(writer, vm), values) for vm, values in rows]
+    conn = writer["conn"]
+    def insert():
+        with conn:  # commits, or rolls back before a retry
+            for sql, values in statements:
+                conn.execute(sql, values)
+    with_busy_retry(insert)
+    if STREAM_ANOMALY:
+        stream_score_vms(dict.fromkeys(vm for vm, _ in rows))
+
+def stream_score_vms(sanitized_vm_ids):
+    """
+    Feeds freshly written rows to the streaming anomaly detector. Its
+    failures are logged only; the entropy scores are already stored.
+    """
+    try:
+        import ransomware_ML_analysis
+    except ImportError as e:
+        print(f"[WARNING] Streaming anomaly detection unavailable: {e}")
+        return
+    for sanitized_vm_id in sanitized_vm_ids:
+        try:
+            ransomware_ML_analysis.run_stream_analysis(canonical_vm_id(sanitized_vm_id))
+        except Exception as e:
+            print(f"[WARNING] Streaming anomaly detection for {sanitized_vm_id}: {e}")
+
+def flush_results():
+    writer = _result_writer
+    if writer is None or not writer["pending"]:
+        return 0
+    rows, writer["pending"] = writer["pending"], []
+    try:
+        write_entropy_rows(writer, rows)
+    except sqlite3.Error:
+        writer["pending"] = rows + writer["pending"]  # kept for the next flush
+        raise
+    print(f"[INFO] Wrote {len(rows)} queued entropy score row(s).")
+    return len(rows)
+
+def begin_result_batch():
+    get_result_writer()["batching"] = True
+
+def pending_result_vms():
+    """
+    Sanitized IDs of the VMs whose rows are queued but not written yet.
+    """
+    if _result_writer is None:
+        return set()
+    return {vm for vm, _ in _result_writer["pending"]}
+
+def db_write_stage():
+    # in batch mode the row is only queued here; the write is timed at the flush
+    return "db_queue" if _result_writer is not None and _result_writer["batching"] else "db_write"
+
+def end_result_batch():
+    if _result_writer is not None:
+        try:
+            flush_results()
+        finally:
+            _result_writer["batching"] = False
+
+def close_result_writer():
+    global _result_writer
+    if _result_writer is None:
+        return
+    try:
+        flush_results()
+    except sqlite3.Error as e:
+        print(f"[ERROR] Writing queued entropy scores: {e}")
+    finally:
+        _result_writer["conn"].close()
+        _result_writer = None
+
 def create_table_and_update_db(vm_id_input,
                                entropy_score, 
                                mean_block_size,
@@ -287,64 +2337,23 @@ def create_table_and_update_db(vm_id_input,
                                chi_square,
                                cpu_usage,
                                mem_free_kb,
-                               mem_used_kb):
+                               mem_used_kb,
+                               extra_metrics=None):
     """
-    Single table for everything. 
-    We'll add new columns (delta_entropy, byte_entropy, chi_square) 
-    to the existing 'entropy_scores_{vm_id_input}' table.
+    One row in the fleet-wide entropy_scores table (visible per VM through
+    the 'entropy_scores_{vm_id_input}' view) through the result writer.
+    vm_id_input is the sanitized VM ID.
+    extra_metrics maps EXTRA_METRIC_COLUMNS names to values; unset ones are 0.
+    Write failures are re-raised so the caller does not count the VM done.
     """
     try:
-        db_path = "/root/aspar.db"
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
         table_name = f"entropy_scores_{vm_id_input}"
-        # We'll assume you already did:
-        # ALTER TABLE <vm_id_input> ADD COLUMN delta_entropy REAL, etc.
-        # But let's do CREATE with all columns. If they exist, great.
-        cursor.execute(f'''
-            CREATE TABLE IF NOT EXISTS {table_name} (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                vm_id_input TEXT,
-                timestamp TEXT,
-                entropy_score REAL,
-                mean_block_size REAL,
-                variance REAL,
-                std_deviation REAL,
-                zeroed_block_ratio REAL,
-                dirty_block_ratio REAL,
-                shannon_entropy REAL,
-                delta_entropy REAL,
-                byte_entropy REAL,
-                chi_square REAL,
-                cpu_usage REAL,
-                mem_free_kb INTEGER,
-                mem_used_kb INTEGER
-            )
-        ''')
+        extra_metrics = extra_metrics or {}
+        extra_values = [extra_metrics.get(name, 0.0) for name, _ in EXTRA_METRIC_COLUMNS]
 
         timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        # Insert all columns
-        cursor.execute(f'''
-            INSERT INTO {table_name} (
-                vm_id_input,
-                timestamp,
-                entropy_score,
-                mean_block_size,
-                variance,
-                std_deviation,
-                zeroed_block_ratio,
-                dirty_block_ratio,
-                shannon_entropy,
-                delta_entropy,
-                byte_entropy,
-                chi_square,
-                cpu_usage, 
-                mem_free_kb, 
-                mem_used_kb
-            )
-            VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-        ''', (
+        values = (
+            canonical_vm_id(vm_id_input),
             vm_id_input,
             timestamp,
             entropy_score,
@@ -359,39 +2368,175 @@ def create_table_and_update_db(vm_id_input,
             chi_square,
             cpu_usage,
             mem_free_kb,
-           mem_used_kb
-        ))
-        conn.commit()
-        conn.close()
-
-        print(f"[INFO] Inserted row into {table_name}, including delta_entropy, byte_entropy, chi_square.")
+            mem_used_kb,
+            *extra_values
+        )
+        writer = get_result_writer()
+        if writer["batching"]:
+            writer["pending"].append((vm_id_input, values))
+            print(f"[INFO] Queued row for {table_name}.")
+            if len(writer["pending"]) >= RESULT_BATCH_ROWS:
+                flush_results()
+        else:
+            write_entropy_rows(writer, [(vm_id_input, values)])
+            print(f"[INFO] Inserted row into {table_name}, including delta_entropy, byte_entropy, chi_square.")
     except Exception as e:
         print(f"[ERROR] create_table_and_update_db: {e}")
+        raise
+
+##############################
+# 5b) STAGE TIMINGS
+##############################
+# Every run of main() records one span per stage (wall time, bytes and
+# items processed, RSS) in pipeline_timings (aspar.db), keyed by VM and
+# checkpoint. peak_rss_kb is this process only; children_peak_rss_kb is the
+# largest peak of any child (the histogram workers), live or reaped. With
+# ASPAR_TIMINGS_JSONL set (or --timings-jsonl) the spans are also appended
+# to that file as JSON lines.
+PIPELINE_TIMINGS_JSONL = os.environ.get("ASPAR_TIMINGS_JSONL")
+
+def current_rss_kb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, IndexError):
+        return 0
+
+def children_peak_rss_kb():
+    """
+    Largest peak RSS among child processes: RUSAGE_CHILDREN covers the
+    reaped ones, VmHWM in /proc the live ones (the shared worker pool).
+    """
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    pids = set()
+    try:
+        for tid in os.listdir("/proc/self/task"):
+            with open(f"/proc/self/task/{tid}/children") as f:
+                pids.update(f.read().split())
+    except OSError:
+        pass
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        peak = max(peak, int(line.split()[1]))
+                        break
+        except (OSError, ValueError, IndexError):
+            continue
+    return peak
+
+def new_run(vm_id_input):
+    return {"vm_id": vm_id_input, "checkpoint": None, "spans": [],
+            "started_at": datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "t0": time.perf_counter()}
+
+def start_span(run, stage):
+    span = {"stage": stage, "started_at": datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "t0": time.perf_counter(), "status": "incomplete",
+            "seconds": None, "bytes_processed": 0, "items": 0}
+    run["spans"].append(span)
+    return span
+
+def end_span(span, bytes_processed=0, items=0):
+    span["seconds"] = time.perf_counter() - span["t0"]
+    span["status"] = "ok"
+    span["bytes_processed"] = int(bytes_processed)
+    span["items"] = int(items)
+    span["rss_kb"] = current_rss_kb()
+    # high-water marks so far (ru_maxrss is in KiB on Linux)
+    span["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    span["children_peak_rss_kb"] = children_peak_rss_kb()
+
+def record_timings(run, jsonl_path=None):
+    """
+    Closes spans left open by an early return or an exception, adds a
+    "total" span and persists the run.
+    """
+    for span in run["spans"]:
+        if span["seconds"] is None:
+            status = span["status"]
+            end_span(span)
+            span["status"] = status
+    total = {"stage": "total", "started_at": run["started_at"], "t0": run["t0"], "status": "ok",
+             "seconds": None}
+    end_span(total, sum(s["bytes_processed"] for s in run["spans"] if s["stage"] == "byte_scan"))
+    spans = run["spans"] + [total]
+
+    rows = [(run["vm_id"], run["checkpoint"], run["started_at"], s["stage"], s["started_at"],
+             s["seconds"], s["bytes_processed"], s["items"], s["rss_kb"], s["peak_rss_kb"], s["status"],
+             s["children_peak_rss_kb"])
+            for s in spans]
+    try:
+        conn = sqlite3.connect(ASPAR_DB)
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS pipeline_timings (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    vm_id TEXT,
+                    checkpoint TEXT,
+                    run_started TEXT,
+                    stage TEXT,
+                    started_at TEXT,
+                    seconds REAL,
+                    bytes_processed INTEGER,
+                    items INTEGER,
+                    rss_kb INTEGER,
+                    peak_rss_kb INTEGER,
+                    status TEXT
+                )
+            """)
+            ensure_columns(conn.cursor(), "pipeline_timings", [("children_peak_rss_kb", "INTEGER")])
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_pipeline_timings_vm_checkpoint
+                ON pipeline_timings(vm_id, checkpoint)
+            """)
+            conn.executemany("""
+                INSERT INTO pipeline_timings (vm_id, checkpoint, run_started, stage, started_at, seconds,
+                                              bytes_processed, items, rss_kb, peak_rss_kb, status,
+                                              children_peak_rss_kb)
+                VALUES (?,?,?,?,?,?,?,?,?,?,?,?)
+            """, rows)
+            conn.commit()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"[WARNING] Pipeline timings not stored: {e}")
+
+    jsonl_path = jsonl_path or PIPELINE_TIMINGS_JSONL
+    if jsonl_path:
+        keys = ("vm_id", "checkpoint", "run_started", "stage", "started_at", "seconds",
+                "bytes_processed", "items", "rss_kb", "peak_rss_kb", "status", "children_peak_rss_kb")
+        try:
+            with open(jsonl_path, "a") as f:
+                for row in rows:
+                    f.write(json.dumps(dict(zip(keys, row))) + "\n")
+        except OSError as e:
+            print(f"[WARNING] Pipeline timings not exported to {jsonl_path}: {e}")
+    print("[INFO] Stage timings: " + ", ".join(f"{s['stage']} {s['seconds']:.3f}s" for s in spans))
 
 ##############################
 # 6) MAIN
 ##############################
-def main(vm_id_input):
+def analyse_vm(vm_id_input, run):
     sanitized_vm_id = vm_id_input.replace('-', '')
-    incremental_table = f"incremental_{sanitized_vm_id}"
 
-    # 1) fetch block-level data for length-based analysis
+    # 1) per-checkpoint sufficient statistics for length-based analysis
+    span = start_span(run, "length_stats")
     try:
-        conn = sqlite3.connect('/root/Backup_Index.db')
-        df = pd.read_sql(f"""
-            SELECT Start,Length,Dirty,Zero,Date,Time
-            FROM "{incremental_table}"
-            WHERE Checkpoint IS NOT NULL
-        """, conn)
-        conn.close()
+        update_length_stats(vm_id_input)
+        length_stats = load_length_stats(vm_id_input)
     except Exception as e:
         print(f"[ERROR] reading incremental data: {e}")
         return
+    end_span(span, items=length_stats["n"])
 
     # 2) Process length-based
-    length_metrics = process_data(df)  # (len_entropy, mean_bs, var, std_dev, zero_ratio, dirty_ratio)
+    length_metrics = length_metrics_from_stats(length_stats)  # (len_entropy, mean_bs, var, std_dev, zero_ratio, dirty_ratio)
     length_entropy = length_metrics[0]
+    span = start_span(run, "sys_metrics")
     cpu_usage, mem_free_kb, mem_used_kb = get_sys_metrics(vm_id_input)
+    end_span(span)
    
     print("\n[INFO] oVirt VM Metrics:")
     print(f"  CPU Usage         : {cpu_usage} %")
@@ -407,25 +2552,16 @@ def main(vm_id_input):
 
 
 
-    # 3) Export for R
-    r_file = f"/tmp/data_{sanitized_vm_id}.txt"
-    df.to_csv(r_file, index=False, header=False)
-
-    # 4) R script
-    r_output = run_r_script(r_file)
-    r_metrics = {}
-    if r_output:
-        for line in r_output.split('\n'):
-            if ":" in line:
-                parts=line.split(':',1)
-                if len(parts)==2:
-                    key,val=parts
-                    key=key.strip()
-                    val=val.strip()
-                    try:
-                        r_metrics[key]=float(val)
-                    except:
-                        pass
+    # 3) + 4) R metrics, in-process unless the Rscript engine is selected
+    span = start_span(run, "r_metrics")
+    if R_ENGINE == "rscript":
+        df = clean_incremental_df(read_incremental_df(vm_id_input))
+        r_file = f"/tmp/data_{sanitized_vm_id}.txt"
+        df[["Start","Length","Dirty","Zero","Date","Time"]].to_csv(r_file, index=False, header=False)
+        r_metrics = parse_r_output(run_r_script(r_file))
+    else:
+        r_metrics = r_metrics_native(length_metrics, length_stats["n"])
+    end_span(span, items=length_stats["n"])
 
     # 5) show table comparing Python vs. R
     def safe_div(n,d): return n/d if d else 0
@@ -481,6 +2617,11 @@ def main(vm_id_input):
             calculate_average(py_entropy_score, r_metrics.get("Weighted Entropy Score",0))
         ]
     ]
+    if R_ENGINE != "rscript":
+        # The native port rounds the same length metrics, so only its own
+        # weighted score differs; % Difference and Average say nothing here.
+        table = [row[:3] for row in table]
+        table[0][2] = "R Port Output"
     print(tabulate(table, headers="firstrow", tablefmt="grid"))
 
     # 6) Now we store the length-based metrics in the table (no delta, byte, chi yet)
@@ -490,13 +2631,14 @@ def main(vm_id_input):
     #    We'll do it once at the end for a single row storing everything.
 
     # 7) get .raw file paths
-    db_paths_str = get_backup_paths(vm_id_input)
+    span = start_span(run, "backup_paths")
+    db_paths_str, checkpoint, disk_id = get_backup_paths(vm_id_input)
+    run["checkpoint"] = checkpoint
+    end_span(span)
     if not db_paths_str:
         print("[WARNING] No Backup_path found -> no Byte Ent / Chi-Square.")
-        # We'll store length-based in DB anyway
-        
-        cpu_usage, mem_free_kb, mem_used_kb = get_sys_metrics(vm_id_input)
-
+        # We'll store length-based in DB anyway (metrics fetched above)
+        span = start_span(run, db_write_stage())
         create_table_and_update_db(
             sanitized_vm_id,
             py_entropy_score,
@@ -513,13 +2655,17 @@ def main(vm_id_input):
             mem_free_kb,
             mem_used_kb
         )
+        end_span(span)
         return
 
-    # 8) copy .raw -> /backup/tmp
-    copied_files = copy_and_list_files(db_paths_str)
-    if not copied_files:
+    # 8) list .raw extents (read in place, no copy)
+    span = start_span(run, "list_raw_files")
+    raw_files = list_raw_files(db_paths_str)
+    end_span(span, items=len(raw_files))
+    if not raw_files:
         print("[INFO] No .raw files found -> no Byte Ent / Chi-Sq.")
         # store length-based anyway
+        span = start_span(run, db_write_stage())
         create_table_and_update_db(
             sanitized_vm_id,
             py_entropy_score,
@@ -537,24 +2683,34 @@ def main(vm_id_input):
             mem_used_kb
 
         )
+        end_span(span)
         return
 
-    # 9) Merge for Byte Ent + Chi-Square
-    all_bytes = bytearray()
-    for cf in copied_files:
-        with open(cf,'rb') as f:
-            all_bytes += f.read()
-
-    for cf in copied_files:
-        try:
-            os.remove(cf)
-        except OSError:
-            pass
-
-    arr = np.frombuffer(all_bytes, dtype=np.uint8)
-    if len(arr)==0:
+    # 9) Streaming histogram (or bounded sample) for Byte Ent + Chi-Square
+    span = start_span(run, "byte_scan")
+    raw_bytes = sum(os.path.getsize(path) for path in raw_files)
+    sampled = raw_bytes > SAMPLE_THRESHOLD_BYTES
+    if sampled:
+        print(f"[INFO] {raw_bytes} dirty bytes > {SAMPLE_THRESHOLD_BYTES}: sampling instead of a full scan.")
+        extent_files = dirty_extent_files(raw_files, get_dirty_extents(vm_id_input, checkpoint))
+        estimate = sample_byte_entropy(extent_files)
+        total_bytes = estimate["sampled_bytes"]
+        block_map = estimate["block_map"]
+        battery = battery_metrics(estimate["freq"], estimate["battery"], wrap=False)
+        ratios = estimate["compress_ratios"]
+        block_class, block_bytes = estimate["block_class"], estimate["block_bytes"]
+        freq = estimate["freq"]
+    else:
+        scan = cached_byte_histogram(raw_files, workers=HISTOGRAM_WORKERS)
+        freq, total_bytes, block_map = scan["freq"], scan["total_bytes"], scan["block_map"]
+        battery = battery_metrics(freq, scan["battery"])
+        ratios = scan["compress_ratios"]
+        block_class, block_bytes = scan["block_class"], scan["block_bytes"]
+    end_span(span, bytes_processed=total_bytes, items=len(raw_files))
+    if total_bytes==0:
         print("[INFO] .raw data empty.")
         # store length-based anyway
+        span = start_span(run, db_write_stage())
         create_table_and_update_db(
             sanitized_vm_id,
             py_entropy_score,
@@ -566,19 +2722,62 @@ def main(vm_id_input):
             length_metrics[0],
             0.0,
             0.0,
-            0.0
+            0.0,
+            cpu_usage,
+            mem_free_kb,
+            mem_used_kb
         )
+        end_span(span)
         return
 
-    # compute byte_entropy
-    freq = np.bincount(arr,minlength=256)
-    probs = freq/len(arr)
-    nz = probs[probs>0]
-    byte_entropy = -np.sum(nz*np.log2(nz))
-
-    # compute chi-square
-    expected = len(arr)/256.0
-    chi_sq = np.sum((freq-expected)**2 / expected)
+    if sampled:
+        byte_entropy = estimate["byte_entropy"]
+        chi_sq = estimate["chi_square"]
+        print(f"[INFO] Sampled {estimate['sample_blocks']} blocks ({total_bytes} of {estimate['population_bytes']} dirty bytes): "
+              f"Byte Entropy {byte_entropy:.5f} +/- {estimate['byte_entropy_ci']:.5f}, "
+              f"Chi-Square {chi_sq:.5f} +/- {estimate['chi_square_ci']:.5f} "
+              f"at {estimate['confidence']*100:.0f}% confidence.")
+    else:
+        print(f"[INFO] Scanned {total_bytes} bytes across {len(raw_files)} extent file(s).")
+        byte_entropy = byte_entropy_from_histogram(freq)
+        chi_sq = chi_square_from_histogram(freq)
+
+    # Per-block entropy map, so a few encrypted regions are not averaged away
+    # (sampled runs only summarise the sampled blocks and keep no map file)
+    map_summary = entropy_map_summary(block_map)
+    if not sampled:
+        save_entropy_map(sanitized_vm_id, checkpoint, block_map)
+    map_summary["sampled_bytes"] = total_bytes
+    map_summary["byte_entropy_ci"] = estimate["byte_entropy_ci"] if sampled else 0.0
+    map_summary["chi_square_ci"] = estimate["chi_square_ci"] if sampled else 0.0
+    map_summary.update(battery)
+    map_summary.update(compressibility_summary(ratios))
+    content = content_summary(block_class, block_bytes, total_bytes, contiguous=not sampled)
+    map_summary.update(content)
+    span = start_span(run, "baseline_drift")
+    try:
+        map_summary.update(update_byte_baseline(vm_id_input, disk_id, freq, checkpoint))
+    except sqlite3.Error as e:
+        print(f"[WARNING] Byte baseline not updated: {e}")
+    end_span(span)
+    print(f"[INFO] Mean: {battery['arithmetic_mean']:.5f}, Serial Correlation: {battery['serial_correlation']:.6f}, "
+          f"Monte Carlo Pi: {battery['monte_carlo_pi']:.6f}, Bigram Entropy: {battery['bigram_entropy']:.5f}")
+    print(f"[INFO] Compression ratio p10/p50/p90: {map_summary['compress_ratio_p10']:.3f}/"
+          f"{map_summary['compress_ratio_p50']:.3f}/{map_summary['compress_ratio_p90']:.3f} "
+          f"({len(ratios)} samples), incompressible: {map_summary['incompressible_fraction']*100:.2f}%")
+    print(f"[INFO] Block Entropy p50/p95/p99: {map_summary['block_entropy_p50']:.3f}/"
+          f"{map_summary['block_entropy_p95']:.3f}/{map_summary['block_entropy_p99']:.3f}, "
+          f"> {HIGH_ENTROPY_BITS} bits: {map_summary['high_entropy_fraction']*100:.2f}% of blocks")
+
+    print(f"[INFO] Drift vs. baseline: KL {map_summary.get('kl_divergence', 0.0):.5f}, "
+          f"JS {map_summary.get('js_divergence', 0.0):.5f} bits")
+    print(f"[INFO] Content: known-compressed {content['known_compressed_fraction']*100:.2f}%, "
+          f"text-like {content['text_fraction']*100:.2f}%, "
+          f"unknown high-entropy {content['unknown_high_entropy_fraction']*100:.2f}% of blocks")
+    content_score = weighted_entropy_score(*length_metrics, cpu_usage, mem_free_kb, mem_used_kb,
+                                           content=content)
+    print(f"[INFO] Weighted Entropy Score with content breakdown: {py_entropy_score} -> {content_score}")
+    py_entropy_score = content_score
 
     # Delta = |Byte - Length|
     delta_entropy = abs(byte_entropy - length_entropy)
@@ -586,6 +2785,7 @@ def main(vm_id_input):
     print(f"\n[INFO] Byte Entropy: {byte_entropy:.5f}, Chi-Square: {chi_sq:.5f}, Delta Entropy: {delta_entropy:.5f}\n")
 
     # Now store everything in the same table
+    span = start_span(run, db_write_stage())
     create_table_and_update_db(
         sanitized_vm_id,
         py_entropy_score,        # length-based Weighted Entropy
@@ -600,17 +2800,176 @@ def main(vm_id_input):
         chi_sq,                   # new
         cpu_usage,
         mem_free_kb,
-        mem_used_kb
+        mem_used_kb,
+        extra_metrics=map_summary
     )
+    end_span(span)
 
     print("[INFO] Done with single-table storage.\n")
 
+def main(vm_id_input):
+    run = new_run(vm_id_input)
+    try:
+        analyse_vm(vm_id_input, run)
+    finally:
+        record_timings(run)
+
+
+##############################
+# 7) BATCH / DAEMON
+##############################
+# One warm process for many VMs: imports, the SSO token, the HTTPS session
+# and the histogram worker pool are shared. VMs with a finished checkpoint
+# can be queued in entropy_queue (aspar.db) for --daemon to pick up; like
+# a direct run, the daemon analyses each VM's latest checkpoint.
+QUEUE_POLL_INTERVAL = 10  # seconds
+
+def run_batch(vm_ids):
+    """
+    Runs main() for each VM in this process. A failing VM is logged and
+    does not stop the others; score rows are written in batches. Returns
+    the VM IDs that failed, including those whose queued row could not be
+    written at the final flush.
+    """
+    failed = []
+    begin_result_batch()
+    try:
+        for vm_id_input in vm_ids:
+            print(f"\n[INFO] ===== Entropy analysis for VM {vm_id_input} =====")
+            started = time.monotonic()
+            try:
+                main(vm_id_input)
+            except Exception as e:
+                print(f"[ERROR] Entropy analysis for {vm_id_input} failed: {e}")
+                failed.append(vm_id_input)
+            print(f"[INFO] VM {vm_id_input} done in {time.monotonic() - started:.2f}s")
+    finally:
+        run = new_run(None)
+        span = start_span(run, "db_write")
+        try:
+            rows = len(_result_writer["pending"]) if _result_writer is not None else 0
+            end_result_batch()
+            end_span(span, items=rows)
+        except sqlite3.Error as e:
+            print(f"[ERROR] Writing queued entropy scores: {e}")
+            span["status"] = "failed"
+            unwritten = pending_result_vms()
+            failed += [vm for vm in vm_ids if vm.replace('-', '') in unwritten and vm not in failed]
+            _result_writer["pending"] = []  # reported failed; not written later at exit
+        finally:
+            record_timings(run)
+    return failed
+
+def open_queue():
+    conn = sqlite3.connect(ASPAR_DB)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS entropy_queue (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            vm_id TEXT,
+            enqueued_at TEXT,
+            status TEXT DEFAULT 'pending',
+            finished_at TEXT
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_entropy_queue_status ON entropy_queue(status)")
+    return conn
+
+def enqueue_vm(vm_id_input):
+    conn = open_queue()
+    try:
+        conn.execute("""
+            INSERT INTO entropy_queue (vm_id, enqueued_at) VALUES (?,?)
+        """, (vm_id_input, datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        conn.commit()
+    finally:
+        conn.close()
+    print(f"[INFO] Queued entropy analysis for {vm_id_input}.")
+
+def process_queue_once():
+    """
+    Claims every pending entry, runs each queued VM once (main() always
+    analyses the VM's latest Backup_path), and marks the entries done or
+    failed. Returns the number of entries processed.
+    """
+    conn = open_queue()
+    try:
+        rows = conn.execute("SELECT id, vm_id FROM entropy_queue WHERE status='pending' ORDER BY id").fetchall()
+        if not rows:
+            return 0
+        conn.executemany("UPDATE entropy_queue SET status='running' WHERE id=?", [(r[0],) for r in rows])
+        conn.commit()
+    finally:
+        conn.close()
+
+    vm_ids = list(dict.fromkeys(vm_id for _, vm_id in rows))
+    failed = set(vm_ids)  # until run_batch returns
+    try:
+        failed = set(run_batch(vm_ids))
+    finally:
+        finished_at = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        conn = open_queue()
+        try:
+            conn.executemany("UPDATE entropy_queue SET status=?, finished_at=? WHERE id=?", [
+                ('failed' if vm_id in failed else 'done', finished_at, queue_id) for queue_id, vm_id in rows
+            ])
+            conn.commit()
+        finally:
+            conn.close()
+    return len(rows)
+
+def run_daemon(poll_interval=QUEUE_POLL_INTERVAL):
+    print(f"[INFO] Entropy daemon polling entropy_queue every {poll_interval}s.")
+    # entries left 'running' by a killed daemon are retried
+    conn = open_queue()
+    conn.execute("UPDATE entropy_queue SET status='pending' WHERE status='running'")
+    conn.commit()
+    conn.close()
+    while True:
+        if process_queue_once() == 0:
+            time.sleep(poll_interval)
+
 
 ##################################
 # Script Entry
 ##################################
 if __name__ == "__main__":
-    if len(sys.argv)!=2:
-        print("Usage: python entropy_analysis.py <VM_ID>")
+    parser = argparse.ArgumentParser(
+        description="Byte/length entropy analysis of the latest incremental backup.",
+        usage="python entropy_analysis.py <VM_ID> [<VM_ID> ...] | --collect-stats | --daemon | --enqueue <VM_ID>"
+              " | --migrate-scores")
+    parser.add_argument("vm_ids", nargs="*", help="one or more VM IDs, analysed in this process")
+    parser.add_argument("--collect-stats", action="store_true", help="store a fleet metrics snapshot and exit")
+    parser.add_argument("--daemon", action="store_true", help="process entropy_queue forever")
+    parser.add_argument("--enqueue", action="store_true", help="queue the given VM for the daemon")
+    parser.add_argument("--migrate-scores", action="store_true",
+                        help="move every per-VM entropy_scores_<vm> table into entropy_scores and exit")
+    parser.add_argument("--workers", type=int, default=HISTOGRAM_WORKERS, help="histogram worker processes")
+    parser.add_argument("--read-mode", choices=["buffered", "fadvise", "direct"], default=READ_MODE,
+                        help="how extent files are read")
+    parser.add_argument("--timings-jsonl", default=PIPELINE_TIMINGS_JSONL, help="also append stage timings to this file")
+    parser.add_argument("--stream-anomaly", action="store_true", default=STREAM_ANOMALY,
+                        help="score each written row with the streaming anomaly detector")
+    args = parser.parse_args()
+
+    HISTOGRAM_WORKERS = args.workers
+    PIPELINE_TIMINGS_JSONL = args.timings_jsonl
+    READ_MODE = args.read_mode
+    STREAM_ANOMALY = args.stream_anomaly
+
+    if args.migrate_scores:
+        migrate_entropy_scores()
+    elif args.collect_stats:
+        collect_fleet_metrics()
+    elif args.daemon:
+        run_daemon()
+    elif args.enqueue:
+        if len(args.vm_ids) != 1:
+            parser.error("--enqueue takes <VM_ID>")
+        enqueue_vm(args.vm_ids[0])
+    elif len(args.vm_ids) == 1:
+        main(args.vm_ids[0])
+    elif args.vm_ids:
+        sys.exit(1 if run_batch(args.vm_ids) else 0)
+    else:
+        parser.print_usage()
         sys.exit(1)
-    main(sys.argv[1])
@@ -0,0 +1,543 @@
+#!/usr/bin/env python3
+"""
+Local benchmark for entropy_analysis.py, no oVirt engine needed.
+
+Generates synthetic full and incremental .raw extents for a handful of VMs
+together with matching incremental_<vm> / table_BI_<vm> rows in a scratch
+Backup_Index.db, then times each pipeline stage (MB/s, peak RSS) and
+scores how well each stage's signal separates clean VMs from VMs whose
+last checkpoint carries ransomware-style AES data.
+
+Usage:
+    python entropy_benchmark.py [--workdir DIR] [--vms N] [--extent-mb N]
+                                [--output results.json] [--compare baseline.json]
+"""
+import os
+import sys
+import io
+import json
+import time
+import uuid
+import gzip
+import shutil
+import sqlite3
+import argparse
+import resource
+import datetime
+import subprocess
+import contextlib
+import multiprocessing
+import numpy as np
+
+DEFAULT_WORKDIR = "/tmp/aspar_bench"
+EXTENT_UNIT = 64 * 1024            # extents are multiples of this, like the CBT ranges
+MAX_EXTENT_UNITS = 64              # up to 4 MiB per extent
+ENCRYPTED_FILE_SIZE = 1024 * 1024  # plaintext size of each "document" openssl encrypts
+ENCRYPTION_KEY = "hacked123"       # same as run_ransomware_sim_remote.sh
+FS_BLOCK = 4096
+
+# Share of dirty bytes per content type in a VM's last checkpoint. Earlier
+# checkpoints always use the VM's clean mix (encrypted share moved to text).
+PROFILES = {
+    "clean_text":       {"zero": 0.3, "text": 0.6, "compressed": 0.1, "encrypted": 0.0},
+    "clean_media":      {"zero": 0.2, "text": 0.2, "compressed": 0.6, "encrypted": 0.0},
+    "ransomware":       {"zero": 0.1, "text": 0.2, "compressed": 0.1, "encrypted": 0.6},
+    "ransomware_light": {"zero": 0.2, "text": 0.45, "compressed": 0.1, "encrypted": 0.25},
+}
+
+# Per-signal decision thresholds used for the accuracy figures
+DETECT_BYTE_ENTROPY = 7.0
+DETECT_FRACTION = 0.2
+DETECT_JS = 0.1
+
+# Regression thresholds for --compare
+THROUGHPUT_TOLERANCE = 0.15
+ACCURACY_TOLERANCE = 0.05
+
+WORDS = (b"backup disk volume report invoice customer order total the of and to in "
+         b"user admin config server log error warning info date time file data "
+         b"record account payment status pending complete failed 2025 42 1337").split()
+
+##############################
+# 1) SYNTHETIC DATA
+##############################
+def text_corpus(rng, size):
+    words = rng.choice(len(WORDS), size // 5)
+    lines = []
+    for i in range(0, len(words), 12):
+        lines.append(b" ".join(WORDS[w] for w in words[i:i+12]))
+    return (b"\n".join(lines) * 2)[:size]
+
+def take(corpus, rng, n):
+    start = int(rng.integers(0, len(corpus) - n)) if len(corpus) > n else 0
+    piece = corpus[start:start + n]
+    return piece * (n // max(len(piece), 1) + 1) if len(piece) < n else piece
+
+def compressed_bytes(corpus, rng, n):
+    """
+    Concatenated gzip members (as a directory of .gz/.jpg-like files would
+    land on disk), each starting on a filesystem block.
+    """
+    out = bytearray()
+    while len(out) < n:
+        member = gzip.compress(take(corpus, rng, 256 * 1024), compresslevel=6)
+        out += member + bytes(-len(member) % FS_BLOCK)
+    return bytes(out[:n])
+
+def openssl_encrypt(plaintext):
+    """
+    openssl enc -aes-256-cbc -salt -k <key>, as run_ransomware_sim_remote.sh
+    does. Falls back to random bytes behind the same "Salted__" header when
+    no openssl binary is available.
+    """
+    try:
+        return subprocess.run(["openssl", "enc", "-aes-256-cbc", "-salt", "-k", ENCRYPTION_KEY],
+                              input=plaintext, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return b"Salted__" + os.urandom(8 + len(plaintext) + 16 - len(plaintext) % 16)
+
+def encrypted_bytes(corpus, rng, n):
+    out = bytearray()
+    while len(out) < n:
+        cipher = openssl_encrypt(take(corpus, rng, ENCRYPTED_FILE_SIZE))
+        out += cipher + bytes(-len(cipher) % FS_BLOCK)
+    return bytes(out[:n])
+
+def content_bytes(kind, corpus, rng, n):
+    if kind == "text":
+        return take(corpus, rng, n)
+    if kind == "compressed":
+        return compressed_bytes(corpus, rng, n)
+    if kind == "encrypted":
+        return encrypted_bytes(corpus, rng, n)
+    return bytes(n)
+
+def plan_extents(rng, mix, total_bytes, disk_bytes):
+    """
+    [(start, length, kind)] covering about total_bytes of a disk_bytes disk,
+    non-overlapping and in start order.
+    """
+    kinds = [k for k in mix if mix[k] > 0]
+    weights = np.array([mix[k] for k in kinds])
+    lengths = []
+    while sum(l for l, _ in lengths) < total_bytes:
+        lengths.append((int(rng.integers(1, MAX_EXTENT_UNITS + 1)) * EXTENT_UNIT,
+                        kinds[rng.choice(len(kinds), p=weights / weights.sum())]))
+    slots = disk_bytes // (MAX_EXTENT_UNITS * EXTENT_UNIT)
+    starts = np.sort(rng.choice(slots, size=len(lengths), replace=False)) * MAX_EXTENT_UNITS * EXTENT_UNIT
+    return [(int(s), l, k) for s, (l, k) in zip(starts, lengths)]
+
+def clean_mix(mix):
+    clean = dict(mix)
+    clean["text"] += clean["encrypted"]
+    clean["encrypted"] = 0.0
+    return clean
+
+def create_vm_tables(conn, sanitized_vm_id):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS incremental_{sanitized_vm_id} (
+          Start TEXT, Length TEXT, Dirty TEXT, Zero TEXT, Date TEXT, Time TEXT, Checkpoint TEXT
+        )
+    """)
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS table_BI_{sanitized_vm_id} (
+            id INTEGER PRIMARY KEY, vm_id TEXT, vm_name TEXT, disk_id TEXT,
+            Full_Backup INTEGER, Backup_path TEXT, Checkpoint TEXT, Time TEXT,
+            Date TEXT, Status TEXT, Duration TEXT, Size TEXT
+        )
+    """)
+
+def generate_dataset(workdir, n_vms, checkpoints, extent_mb, seed):
+    """
+    Writes the synthetic VMs under workdir and returns their manifest:
+    [{"vm_id", "profile", "attacked", "disk_id", "checkpoints": [...],
+      "raw_files": [paths of the last checkpoint], "dirty_bytes"}]
+    """
+    rng = np.random.default_rng(seed)
+    corpus = text_corpus(rng, 8 * 1024 * 1024)
+    disk_bytes = 64 * 1024**3
+    profiles = list(PROFILES)
+    backup_index = sqlite3.connect(os.path.join(workdir, "Backup_Index.db"))
+    aspar = sqlite3.connect(os.path.join(workdir, "aspar.db"))
+    aspar.execute("""
+        CREATE TABLE IF NOT EXISTS vm_metrics_snapshots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, vm_id TEXT, timestamp TEXT, epoch REAL,
+            cpu_usage REAL, mem_free_kb INTEGER, mem_used_kb INTEGER
+        )
+    """)
+    manifest = []
+    day = datetime.datetime(2025, 5, 1, 21, 0, 0)
+    for v in range(n_vms):
+        profile = profiles[v % len(profiles)]
+        vm_id = str(uuid.UUID(int=int(rng.integers(0, 2**63)) << 64 | v))
+        sanitized_vm_id = vm_id.replace('-', '')
+        vm_name = f"bench{v:02d}"
+        disk_id = str(uuid.UUID(int=int(rng.integers(0, 2**63)) << 32 | v))
+        create_vm_tables(backup_index, sanitized_vm_id)
+
+        full_path = os.path.join(workdir, f"Full_backup_{vm_name}.raw")
+        with open(full_path, "wb") as f:
+            for _, length, kind in plan_extents(rng, clean_mix(PROFILES[profile]), extent_mb * 1024**2,
+                                                disk_bytes):
+                f.write(content_bytes(kind, corpus, rng, length))
+        backup_index.execute(f"""
+            INSERT INTO table_BI_{sanitized_vm_id}
+                (vm_id, vm_name, disk_id, Full_Backup, Backup_path, Checkpoint, Time, Date, Status, Size)
+            VALUES (?,?,?,?,?,?,?,?,?,?)
+        """, (vm_id, vm_name, disk_id, 1, full_path, str(uuid.uuid4()), day.strftime('%H:%M:%S'),
+              day.strftime('%Y-%m-%d'), "Replication COMPLETE Successfully",
+              f"{os.path.getsize(full_path)/1024**2:.2f}"))
+
+        entry = {"vm_id": vm_id, "profile": profile, "attacked": PROFILES[profile]["encrypted"] > 0,
+                 "disk_id": disk_id, "checkpoints": [], "raw_files": [], "dirty_bytes": 0}
+        for c in range(checkpoints):
+            last = c == checkpoints - 1
+            mix = PROFILES[profile] if last else clean_mix(PROFILES[profile])
+            stamp = day + datetime.timedelta(hours=c + 1)
+            checkpoint = str(uuid.uuid4())
+            restore_dir = os.path.join(workdir, "restore", vm_id, stamp.strftime('%Y%m%d_%H%M%S'))
+            os.makedirs(restore_dir, exist_ok=True)
+            raw_files = []
+            for start, length, kind in plan_extents(rng, mix, extent_mb * 1024**2, disk_bytes):
+                zero = kind == "zero"
+                backup_index.execute(f"""
+                    INSERT INTO incremental_{sanitized_vm_id} (Start, Length, Dirty, Zero, Date, Time, Checkpoint)
+                    VALUES (?,?,?,?,?,?,?)
+                """, (str(start), str(length), "false" if zero else "true", "true" if zero else "false",
+                      stamp.strftime('%Y-%m-%d'), stamp.strftime('%H:%M:%S'), checkpoint))
+                if zero:
+                    continue
+                path = os.path.join(restore_dir, f"{vm_id}_{start}_{length}.raw")
+                with open(path, "wb") as f:
+                    f.write(content_bytes(kind, corpus, rng, length))
+                raw_files.append(path)
+            # the newest incremental is the one entropy_analysis.py picks up
+            backup_index.execute(f"""
+                INSERT INTO table_BI_{sanitized_vm_id}
+                    (vm_id, vm_name, disk_id, Full_Backup, Backup_path, Checkpoint, Time, Date, Status, Size)
+                VALUES (?,?,?,?,?,?,?,?,?,?)
+            """, (vm_id, vm_name, disk_id, 25 if last else 0, ", ".join(raw_files), checkpoint,
+                  stamp.strftime('%H:%M:%S'), stamp.strftime('%Y-%m-%d'),
+                  "Replication COMPLETE Successfully",
+                  f"{sum(os.path.getsize(p) for p in raw_files)/1024**2:.2f}"))
+            entry["checkpoints"].append({"checkpoint": checkpoint, "raw_files": raw_files})
+        entry["raw_files"] = entry["checkpoints"][-1]["raw_files"]
+        entry["dirty_bytes"] = sum(os.path.getsize(p) for p in entry["raw_files"])
+        aspar.execute("""
+            INSERT INTO vm_metrics_snapshots (vm_id, timestamp, epoch, cpu_usage, mem_free_kb, mem_used_kb)
+            VALUES (?,?,?,?,?,?)
+        """, (vm_id, "", 4102444800.0, 12.5, 4 * 1024**2, 2 * 1024**2))  # never stale during a run
+        manifest.append(entry)
+        print(f"[INFO] Generated {vm_name} ({profile}): {checkpoints} checkpoint(s), "
+              f"{entry['dirty_bytes']/1024**2:.1f} MiB in the last one.")
+    backup_index.commit()
+    aspar.commit()
+    backup_index.close()
+    aspar.close()
+    return manifest
+
+##############################
+# 2) STAGES
+##############################
+# Every stage runs in a forked child so its peak RSS is its own. A stage
+# returns (bytes_processed, {vm_id: {signal: value}}), plus its seconds
+# when only part of its work is to be timed.
+def use_workdir(workdir):
+    """
+    Points entropy_analysis.py at the scratch databases; must run before
+    it is imported.
+    """
+    os.environ["ASPAR_BACKUP_INDEX_DB"] = os.path.join(workdir, "Backup_Index.db")
+    os.environ["ASPAR_DB"] = os.path.join(workdir, "aspar.db")
+    os.environ["ASPAR_VM_SETTINGS_DB"] = os.path.join(workdir, "vmSettings.db")
+    os.environ["ASPAR_HISTOGRAM_CACHE_DB"] = os.path.join(workdir, "histogram_cache.db")
+    os.environ["ASPAR_ENTROPY_MAP_DIR"] = os.path.join(workdir, "entropy_maps")
+
+def scan_signals(ea, scan, contiguous=True):
+    total = int(scan["freq"].sum())
+    content = ea.content_summary(scan["block_class"], scan["block_bytes"], total, contiguous)
+    return {
+        "byte_entropy": ea.byte_entropy_from_histogram(scan["freq"]) if total else 0.0,
+        "high_entropy_fraction": ea.entropy_map_summary(scan["block_map"])["high_entropy_fraction"],
+        "incompressible_fraction": ea.compressibility_summary(scan["compress_ratios"])["incompressible_fraction"],
+        "unknown_high_entropy_fraction": content["unknown_high_entropy_fraction"],
+    }
+
+def stage_length_stats(ea, manifest, workers):
+    rows = 0
+    out = {}
+    for vm in manifest:
+        ea.update_length_stats(vm["vm_id"])
+        stats = ea.load_length_stats(vm["vm_id"])
+        rows += stats["n"]
+        out[vm["vm_id"]] = {"length_entropy": ea.length_metrics_from_stats(stats)[0]}
+    return rows, out
+
+def stage_scan(workers):
+    def run(ea, manifest, _):
+        out = {}
+        for vm in manifest:
+            out[vm["vm_id"]] = scan_signals(ea, ea.stream_byte_histogram(vm["raw_files"], workers=workers))
+        return sum(vm["dirty_bytes"] for vm in manifest), out
+    return run
+
+def stage_read(mode):
+    """
+    Serial scan in one extent read mode, starting from a cold page cache.
+    """
+    def run(ea, manifest, _):
+        ea.READ_MODE = mode
+        out = {}
+        for vm in manifest:
+            out[vm["vm_id"]] = scan_signals(ea, ea.stream_byte_histogram(vm["raw_files"], workers=1))
+        return sum(vm["dirty_bytes"] for vm in manifest), out
+    return run
+
+def stage_battery(ea, manifest, _):
+    """
+    The randomness battery alone over already read chunks, to set its cost
+    against the byte bincount (stage histogram) both scan stages pay.
+    """
+    chunks = [arr for vm in manifest for path in vm["raw_files"] for arr in ea.iter_file_chunks(path)]
+    started = time.perf_counter()
+    for arr in chunks:
+        ea.battery_update(ea.battery_state(), arr)
+    return sum(len(arr) for arr in chunks), {}, time.perf_counter() - started
+
+def stage_histogram(ea, manifest, _):
+    chunks = [arr for vm in manifest for path in vm["raw_files"] for arr in ea.iter_file_chunks(path)]
+    started = time.perf_counter()
+    for arr in chunks:
+        np.bincount(arr, minlength=256)
+    return sum(len(arr) for arr in chunks), {}, time.perf_counter() - started
+
+def drop_page_cache(manifest):
+    for vm in manifest:
+        for path in vm["raw_files"]:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            finally:
+                os.close(fd)
+
+def stage_cached(ea, manifest, workers):
+    out = {}
+    for vm in manifest:
+        out[vm["vm_id"]] = scan_signals(ea, ea.cached_byte_histogram(vm["raw_files"], workers=workers))
+    return sum(vm["dirty_bytes"] for vm in manifest), out
+
+def stage_sampling(ea, manifest, workers):
+    out = {}
+    sampled = 0
+    for vm in manifest:
+        checkpoint = vm["checkpoints"][-1]["checkpoint"]
+        extent_files = ea.dirty_extent_files(vm["raw_files"], ea.get_dirty_extents(vm["vm_id"], checkpoint))
+        estimate = ea.sample_byte_entropy(extent_files, seed=0)
+        sampled += estimate["sampled_bytes"]
+        signals = scan_signals(ea, estimate, contiguous=False)
+        signals["byte_entropy"] = estimate["byte_entropy"]
+        out[vm["vm_id"]] = signals
+    return sampled, out
+
+def stage_drift(ea, manifest, workers):
+    out = {}
+    scanned = 0
+    for vm in manifest:
+        for cp in vm["checkpoints"]:
+            scan = ea.cached_byte_histogram(cp["raw_files"], workers=workers)
+            scanned += int(scan["freq"].sum())
+            drift = ea.update_byte_baseline(vm["vm_id"], vm["disk_id"], scan["freq"], cp["checkpoint"])
+        out[vm["vm_id"]] = {"js_divergence": drift["js_divergence"]}
+    return scanned, out
+
+def stage_end_to_end(ea, manifest, workers):
+    out = {}
+    for vm in manifest:
+        ea.main(vm["vm_id"])
+        conn = sqlite3.connect(ea.ASPAR_DB)
+        try:
+            row = conn.execute("""
+                SELECT byte_entropy, sampled_bytes, unknown_high_entropy_bytes
+                FROM entropy_scores WHERE vm_id = ? ORDER BY id DESC LIMIT 1
+            """, (vm["vm_id"],)).fetchone()
+        finally:
+            conn.close()
+        out[vm["vm_id"]] = {"byte_entropy": row[0],
+                            "unknown_high_entropy_fraction": row[2] / row[1] if row[1] else 0.0}
+    return sum(vm["dirty_bytes"] for vm in manifest), out
+
+# signal -> decision threshold
+SIGNAL_THRESHOLDS = {
+    "byte_entropy": DETECT_BYTE_ENTROPY,
+    "high_entropy_fraction": DETECT_FRACTION,
+    "incompressible_fraction": DETECT_FRACTION,
+    "unknown_high_entropy_fraction": DETECT_FRACTION,
+    "js_divergence": DETECT_JS,
+}
+
+def _stage_child(ea, stage, manifest, workers, pipe):
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        processed, signals, *timed = stage(ea, manifest, workers)
+    # stages that time only their compute part return those seconds
+    seconds = timed[0] if timed else time.perf_counter() - started
+    pool_size = 1  # serial unless a scan started the worker pool
+    if ea._worker_pool is not None:
+        pool_size = ea._worker_pool_size
+        ea._worker_pool.shutdown()  # reap the workers so RUSAGE_CHILDREN sees them
+    peak_kb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    pipe.send({"seconds": seconds, "processed": processed, "peak_rss_mb": peak_kb / 1024,
+               "workers": pool_size, "signals": signals})
+    pipe.close()
+
+def run_stage(ea, name, stage, manifest, workers):
+    ctx = multiprocessing.get_context("fork")
+    parent, child = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_stage_child, args=(ea, stage, manifest, workers, child))
+    proc.start()
+    child.close()
+    try:
+        result = parent.recv()
+    except EOFError:
+        proc.join()
+        raise RuntimeError(f"stage {name} failed (exit code {proc.exitcode})")
+    proc.join()
+    return result
+
+def detection_accuracy(manifest, signals):
+    """
+    Accuracy of each signal at its SIGNAL_THRESHOLDS cut, clean vs. attacked.
+    """
+    accuracy = {}
+    for signal, threshold in SIGNAL_THRESHOLDS.items():
+        hits = [(signals[vm["vm_id"]][signal] > threshold) == vm["attacked"]
+                for vm in manifest if signal in signals.get(vm["vm_id"], {})]
+        if hits:
+            accuracy[signal] = sum(hits) / len(hits)
+    return accuracy
+
+##############################
+# 3) REPORT / REGRESSIONS
+##############################
+def release_label():
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def print_report(results):
+    from tabulate import tabulate
+    table = []
+    for name, stage in results["stages"].items():
+        accuracy = ", ".join(f"{k} {v*100:.0f}%" for k, v in stage["accuracy"].items()) or "n/a"
+        table.append([name, f"{stage['seconds']:.2f}", f"{stage['throughput']:.1f} {stage['unit']}",
+                      stage.get("workers", ""), f"{stage['peak_rss_mb']:.0f}", accuracy])
+    print(tabulate(table, headers=["Stage", "Seconds", "Throughput", "Workers", "Peak RSS (MiB)",
+                                   "Detection accuracy"],
+                   tablefmt="grid"))
+
+def compare_results(results, baseline, tolerance=THROUGHPUT_TOLERANCE):
+    """
+    Lists stages that got slower, bigger or less accurate than baseline.
+    """
+    regressions = []
+    for name, stage in results["stages"].items():
+        base = baseline.get("stages", {}).get(name)
+        if base is None:
+            continue
+        if stage["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {stage['throughput']:.1f} < {base['throughput']:.1f} {stage['unit']}")
+        if stage["peak_rss_mb"] > base["peak_rss_mb"] * (1 + tolerance):
+            regressions.append(f"{name}: peak RSS {stage['peak_rss_mb']:.0f} > {base['peak_rss_mb']:.0f} MiB")
+        for signal, value in stage["accuracy"].items():
+            if value < base["accuracy"].get(signal, 0.0) - ACCURACY_TOLERANCE:
+                regressions.append(f"{name}: {signal} accuracy {value*100:.0f}% < "
+                                   f"{base['accuracy'][signal]*100:.0f}%")
+    return regressions
+
+def run_benchmark(workdir, n_vms, checkpoints, extent_mb, workers, seed):
+    if os.path.exists(workdir):
+        shutil.rmtree(workdir)
+    os.makedirs(workdir)
+    use_workdir(workdir)
+    import entropy_analysis as ea
+    # stages that do not pass workers (cached scans, main) use the default
+    ea.HISTOGRAM_WORKERS = workers
+
+    started = time.perf_counter()
+    manifest = generate_dataset(workdir, n_vms, checkpoints, extent_mb, seed)
+    print(f"[INFO] Synthetic data generated in {time.perf_counter() - started:.1f}s.")
+
+    stages = [
+        ("length_stats", stage_length_stats, "rows/s"),
+        ("read_buffered", stage_read("buffered"), "MB/s"),
+        ("read_fadvise", stage_read("fadvise"), "MB/s"),
+        ("read_direct", stage_read("direct"), "MB/s"),
+        ("histogram", stage_histogram, "MB/s"),
+        ("battery", stage_battery, "MB/s"),
+        ("scan_serial", stage_scan(1), "MB/s"),
+        ("scan_parallel", stage_scan(workers), "MB/s"),
+        ("scan_cached_cold", stage_cached, "MB/s"),
+        ("scan_cached_warm", stage_cached, "MB/s"),
+        ("sampling", stage_sampling, "MB/s"),
+        ("drift_baseline", stage_drift, "MB/s"),
+        ("end_to_end", stage_end_to_end, "MB/s"),
+    ]
+    results = {"label": release_label(), "date": datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+               "config": {"vms": n_vms, "checkpoints": checkpoints, "extent_mb": extent_mb,
+                          "workers": workers, "seed": seed},
+               "stages": {}}
+    for name, stage, unit in stages:
+        print(f"[INFO] Running stage {name}...")
+        if name.startswith("read_"):
+            drop_page_cache(manifest)
+        r = run_stage(ea, name, stage, manifest, workers)
+        scale = 1 if unit == "rows/s" else 1e6
+        results["stages"][name] = {
+            "seconds": r["seconds"],
+            "throughput": r["processed"] / scale / r["seconds"] if r["seconds"] else 0.0,
+            "unit": unit,
+            "peak_rss_mb": r["peak_rss_mb"],
+            "workers": r["workers"],
+            "accuracy": detection_accuracy(manifest, r["signals"]),
+        }
+    return results
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the entropy pipeline on synthetic extents.")
+    parser.add_argument("--workdir", default=DEFAULT_WORKDIR)
+    parser.add_argument("--vms", type=int, default=8, help="synthetic VMs (profiles rotate)")
+    parser.add_argument("--checkpoints", type=int, default=3, help="incrementals per VM")
+    parser.add_argument("--extent-mb", type=int, default=16, help="dirty MiB per checkpoint")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--compare", help="baseline JSON from an earlier release; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=THROUGHPUT_TOLERANCE)
+    parser.add_argument("--keep", action="store_true", help="keep the synthetic data")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    results = run_benchmark(args.workdir, args.vms, args.checkpoints, args.extent_mb,
+                            args.workers, args.seed)
+    print_report(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"[INFO] Results written to {args.output}")
+    if not args.keep:
+        shutil.rmtree(args.workdir, ignore_errors=True)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare_results(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"[ERROR] Regression: {line}")
+        if regressions:
+            sys.exit(1)
+        print("[INFO] No regressions against the baseline.")
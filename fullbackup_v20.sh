@@ -985,16 +985,22 @@ if [[ -z "$rpo" || ! "$rpo" =~ ^[0-9]+$ ]]; then
   exit 1
 fi
 
+# One fleet-wide ML run replaces the per-VM entries; it follows the shortest RPO
+fleet_rpo=$(sqlite3 /root/vmSettings.db "SELECT MIN(CAST(RPO AS INTEGER)) FROM vmAttribs WHERE CAST(RPO AS INTEGER) > 0")
+if [[ -z "$fleet_rpo" || ! "$fleet_rpo" =~ ^[0-9]+$ ]]; then
+  fleet_rpo=$rpo
+fi
+
 # Calculate cron schedule
-minute=$((rpo + 2))
+minute=$((fleet_rpo + 2))
 
 # Define ML cron entry
-cron_entry="*/$minute * * * * PATH=/usr/local/bin:/usr/bin:/bin /root/myenv/bin/python /root/ransomware_ML_analysis.py $vm_id_input >> /backup/tmp/ransom_$vm_id_input.txt 2>&1"
+cron_entry="*/$minute * * * * PATH=/usr/local/bin:/usr/bin:/bin /root/myenv/bin/python /root/ransomware_ML_analysis.py --fleet >> /backup/tmp/ransom_fleet.txt 2>&1"
 
 echo "Scheduled ML entry: $cron_entry"
 
-# Add ML cron job
-(crontab -l 2>/dev/null | grep -v "ransomware_ML_analysis.py $vm_id_input"; echo "$cron_entry") | crontab -
+# Add ML cron job (dropping the old per-VM entries)
+(crontab -l 2>/dev/null | grep -v "ransomware_ML_analysis.py"; echo "$cron_entry") | crontab -
 
 # Insert cron entry for AI ransomware analytics
 APSAR_Model=$(sqlite3 /root/vmSettings.db "SELECT APSAR_Model FROM vmAttribs WHERE vmId = '$vm_id_input'")
@@ -1,16 +1,75 @@
+import os
+import re
+import argparse
 import sqlite3
 import pandas as pd
 import logging
+import joblib
+from joblib import Parallel, delayed
+import sklearn
 from sklearn.ensemble import IsolationForest
 import numpy as np
-from datetime import datetime
+from datetime import datetime, timedelta
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 
+# Same override as entropy_analysis.py, so both scripts see one database
+ASPAR_DB = os.environ.get("ASPAR_DB", "/root/aspar.db")
+
+# Fitted models are persisted per VM so each cron tick only scores the rows
+# written since the previous tick. Bump MODEL_VERSION whenever the features
+# or the forest parameters change; stale models are refitted on load.
+MODEL_DIR = os.environ.get("ASPAR_ML_MODEL_DIR", "/root/ml_models")
+MODEL_VERSION = 2
+MODEL_FEATURES = ["entropy_score", "mean_block_size", "variance", "std_deviation",
+                  "zeroed_block_ratio", "dirty_block_ratio", "shannon_entropy"]
+
+# Temporal features of aspar_anomaly_detection.R: row-to-row deltas of these
+# columns plus time_diff (seconds since the previous row). The forest sees
+# the raw columns and these, min-max normalised by the training window.
+DELTA_FEATURES = {
+    "delta_entropy": "entropy_score",
+    "delta_dirty": "dirty_block_ratio",
+    "delta_zeroed": "zeroed_block_ratio",
+    "delta_variance": "variance",
+    "delta_std_dev": "std_deviation",
+    "delta_mean_block": "mean_block_size",
+}
+DELTA_SOURCES = [MODEL_FEATURES.index(column) for column in DELTA_FEATURES.values()]
+ENGINEERED_FEATURES = MODEL_FEATURES + list(DELTA_FEATURES) + ["time_diff"]
+
+# Refits use at most the newest TRAIN_WINDOW rows, so neither scoring nor
+# refitting grows with the VM's history.
+TRAIN_WINDOW = int(os.environ.get("ASPAR_ML_TRAIN_WINDOW", "5000"))
+REFIT_HOURS = float(os.environ.get("ASPAR_ML_REFIT_HOURS", "24"))
+
+# A batch of new rows whose feature means sit more than DRIFT_THRESHOLD
+# training standard deviations away from the training means forces a refit.
+DRIFT_THRESHOLD = float(os.environ.get("ASPAR_ML_DRIFT_THRESHOLD", "3.0"))
+DRIFT_MIN_ROWS = 3
+
+# Streaming mode keeps a robust EWMA mean/variance per feature in aspar.db
+# and scores each new row by its largest |z|, so an update costs the same
+# no matter how long the history is.
+ML_MODE = os.environ.get("ASPAR_ML_MODE", "batch")  # batch | stream
+STREAM_STATE_VERSION = 1
+STREAM_ALPHA = float(os.environ.get("ASPAR_STREAM_ALPHA", "0.05"))
+STREAM_WARMUP = int(os.environ.get("ASPAR_STREAM_WARMUP", "10"))
+STREAM_Z_THRESHOLD = float(os.environ.get("ASPAR_STREAM_Z_THRESHOLD", "4.0"))
+STREAM_CLIP_Z = 3.0      # updates are winsorized to mean +/- STREAM_CLIP_Z sd
+STREAM_RATE_ALPHA = 0.05  # smoothing of the reported anomaly percentage
+STREAM_REL_FLOOR = 0.05   # sd never below 5% of the mean (flat features)
+STREAM_EPS = 1e-12
+
+# --fleet analyses every VM in one process: one query loads the rows, the
+# per-VM models are fitted/scored on ML_WORKERS cores and all results are
+# committed in one transaction. One cron line replaces one per VM.
+ML_WORKERS = int(os.environ.get("ASPAR_ML_WORKERS", str(os.cpu_count() or 1)))
+
 # Function to create the table if it doesn't exist
 def create_table_if_not_exists():
-    db_path = '/root/aspar.db'
+    db_path = ASPAR_DB
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
 
@@ -24,22 +83,102 @@ def create_table_if_not_exists():
     );
     """
     cursor.execute(create_table_query)
+
+    # batch (windowed IsolationForest fraction) and stream (EWMA rate)
+    # percentages are not comparable; rows say which mode wrote them.
+    # Rows from before the column existed were batch runs.
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(ransomware_analysis_results)")}
+    if "mode" not in columns:
+        cursor.execute("ALTER TABLE ransomware_analysis_results ADD COLUMN mode TEXT DEFAULT 'batch'")
+
+    # Per-row labels, keyed to the entropy_scores row they describe and the
+    # mode that labelled it (batch and stream scores are not comparable)
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(ransomware_anomaly_labels)")}
+    if columns and "mode" not in columns:
+        # the key changes, so the table is rebuilt; old labels were batch labels
+        cursor.execute("ALTER TABLE ransomware_anomaly_labels RENAME TO ransomware_anomaly_labels_old")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS ransomware_anomaly_labels (
+        vmid TEXT,
+        mode TEXT,
+        entropy_id INTEGER,
+        label INTEGER,
+        score REAL,
+        timestamp TEXT,
+        PRIMARY KEY (vmid, mode, entropy_id)
+    ) WITHOUT ROWID;
+    """)
+    if columns and "mode" not in columns:
+        cursor.execute("""
+        INSERT INTO ransomware_anomaly_labels (vmid, mode, entropy_id, label, score, timestamp)
+        SELECT vmid, 'batch', entropy_id, label, score, timestamp FROM ransomware_anomaly_labels_old
+        """)
+        cursor.execute("DROP TABLE ransomware_anomaly_labels_old")
     conn.commit()
     conn.close()
 
-# Function to fetch entropy data from the database
-def fetch_entropy_data(vmid):
-    db_path = '/root/aspar.db'
+# Function to drop the comma-joined anomaly_raw_data strings older runs
+# stored and give the space back. The per-row labels replace them.
+def compact_analysis_results():
+    db_path = ASPAR_DB
+    conn = sqlite3.connect(db_path, timeout=30)
+    with conn:
+        cleared = conn.execute("""
+            UPDATE ransomware_analysis_results SET anomaly_raw_data = NULL
+            WHERE anomaly_raw_data IS NOT NULL
+        """).rowcount
+    conn.execute("VACUUM")
+    conn.close()
+    logging.info(f"Cleared anomaly_raw_data of {cleared} ransomware_analysis_results row(s).")
+
+# Label records for bulk exports: 13 bytes per row instead of SQL rows
+LABEL_EXPORT_DTYPE = np.dtype([("entropy_id", "<i8"), ("label", "i1"), ("score", "<f4")])
+
+# Function to export a VM's labels of one mode as one .npy blob
+# (LABEL_EXPORT_DTYPE, in entropy_id order; NaN scores were not scored
+# yet). Returns the rows.
+def export_labels(vmid, path, mode="batch"):
+    db_path = ASPAR_DB
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("""
+        SELECT entropy_id, label, score FROM ransomware_anomaly_labels
+        WHERE vmid = ? AND mode = ? ORDER BY entropy_id
+    """, (vmid, mode)).fetchall()
+    conn.close()
+    blob = np.array([(i, l, np.nan if s is None else s) for i, l, s in rows], dtype=LABEL_EXPORT_DTYPE)
+    np.save(path, blob)
+    logging.info(f"Exported {len(blob)} label(s) of VMID: {vmid} to {path}")
+    return len(blob)
+
+# Function to tell whether entropy_scores_<vm> is still a per-VM table or
+# already a view over the fleet-wide entropy_scores table (ids differ)
+def entropy_source(vmid):
+    db_path = ASPAR_DB
+    conn = sqlite3.connect(db_path)
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = ?",
+                       (f"entropy_scores_{vmid.replace('-', '')}",)).fetchone()
+    conn.close()
+    return row[0] if row else None
+
+# Function to fetch entropy data from the database. after_id restricts the
+# result to rows written since the last scored row; limit keeps only the
+# newest rows. Rows come back in id order either way.
+def fetch_entropy_data(vmid, after_id=0, limit=None):
+    db_path = ASPAR_DB
     query = f"""
-        SELECT timestamp, entropy_score, mean_block_size, variance, std_deviation,
-               zeroed_block_ratio, dirty_block_ratio, shannon_entropy
+        SELECT id, timestamp, {', '.join(MODEL_FEATURES)}
         FROM entropy_scores_{vmid.replace('-', '')}  -- Removing hyphens for sanitized VM ID
-        ORDER BY timestamp;
+        WHERE id > ?
+        ORDER BY id DESC
     """
+    params = [after_id]
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
     conn = sqlite3.connect(db_path)
-    data = pd.read_sql_query(query, conn)
+    data = pd.read_sql_query(query, conn, params=params)
     conn.close()
-    return data
+    return data.iloc[::-1].reset_index(drop=True)
 
 # Function to run Isolation Forest on the data
 def run_isolation_forest(data):
@@ -52,53 +191,530 @@ def run_isolation_forest(data):
     # Store raw anomaly data (1 = normal, -1 = anomaly)
     anomaly_raw_data = predictions.tolist()
     
-    return anomaly_raw_data, anomaly_percentage
+    return model, anomaly_raw_data, anomaly_percentage
 
-# Function to insert the results into the database
-def insert_analysis_results(vmid, timestamp, anomaly_raw_data, anomaly_percentage):
-    db_path = '/root/aspar.db'
-    conn = sqlite3.connect(db_path)
+# Function to score rows with a fitted forest. Returns (predictions,
+# scores); scores are -decision_function, so > 0 means anomaly.
+def isolation_forest_scores(model, features):
+    scores = -model.decision_function(features)
+    return np.where(scores > 0, -1, 1), scores
+
+# Function to pair each scored entropy_scores id with its label and score
+def anomaly_labels(ids, predictions, scores):
+    return list(zip((int(i) for i in ids), (int(p) for p in predictions),
+                    (None if s is None else float(s) for s in scores)))
+
+# Function to locate the persisted model of a VM
+def model_path(vmid):
+    return os.path.join(MODEL_DIR, f"{vmid.replace('-', '')}.joblib")
+
+# Function to load the persisted model state, or None when it is missing,
+# unreadable or stamped by another MODEL_VERSION / scikit-learn release
+def load_model_state(vmid):
+    path = model_path(vmid)
+    if not os.path.exists(path):
+        return None
+    try:
+        state = joblib.load(path)
+    except Exception as e:
+        logging.warning(f"Could not load model {path}: {e}")
+        return None
+    if (state.get("model_version") != MODEL_VERSION
+            or state.get("sklearn_version") != sklearn.__version__):
+        logging.info(f"Model {path} has a stale version stamp, refitting.")
+        return None
+    return state
+
+# Function to persist the model state atomically
+def save_model_state(vmid, state):
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    path = model_path(vmid)
+    tmp_path = f"{path}.tmp"
+    joblib.dump(state, tmp_path)
+    os.replace(tmp_path, path)
+
+# Function to turn entropy_scores timestamps into epoch seconds (NaN when
+# unparseable)
+def timestamp_seconds(timestamps):
+    parsed = pd.to_datetime(timestamps, format='%Y-%m-%d %H:%M:%S', errors='coerce')
+    return ((parsed - pd.Timestamp(0)).dt.total_seconds()).to_numpy(dtype=np.float64)
+
+# Function to derive the temporal features of rows in one vectorized pass.
+# last_row is the window state of the row just before data (its raw values
+# and timestamp); without it the first row gets zero deltas, as in R.
+def temporal_features(data, last_row=None):
+    raw = data[MODEL_FEATURES].to_numpy(dtype=np.float64)
+    seconds = timestamp_seconds(data["timestamp"])
+    if last_row is None:
+        previous_raw, previous_seconds = raw[:1], seconds[:1]
+    else:
+        previous_raw, previous_seconds = last_row["values"][None, :], [last_row["seconds"]]
+    deltas = np.diff(raw, axis=0, prepend=previous_raw)[:, DELTA_SOURCES]
+    time_diff = np.nan_to_num(np.diff(seconds, prepend=previous_seconds))
+    return pd.DataFrame(np.column_stack([raw, deltas, time_diff]), columns=ENGINEERED_FEATURES)
+
+# Function to keep the window state needed for the next rows' deltas
+def last_row_state(data):
+    return {
+        "values": data[MODEL_FEATURES].iloc[-1].to_numpy(dtype=np.float64),
+        "seconds": float(timestamp_seconds(data["timestamp"].iloc[-1:])[0]),
+    }
+
+# Function to build the normalised model input of new rows from the state
+def model_features(state, data):
+    features = temporal_features(data, state["last_row"])
+    return (features - state["feature_min"]) / state["feature_span"]
+
+# Function to fit a fresh model on the newest TRAIN_WINDOW rows
+def fit_model_state(data, source):
+    if data.empty:
+        return None, []
+    features = temporal_features(data)
+    feature_min = features.min().to_numpy()
+    feature_span = features.max().to_numpy() - feature_min
+    feature_span[feature_span == 0] = 1.0  # constant columns normalise to 0
+    features = (features - feature_min) / feature_span
+    model, _, _ = run_isolation_forest(features)
+    predictions, scores = isolation_forest_scores(model, features)
+    state = {
+        "model": model,
+        "model_version": MODEL_VERSION,
+        "sklearn_version": sklearn.__version__,
+        "source": source,
+        "fitted_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        "fitted_rows": len(data),
+        "feature_min": feature_min,
+        "feature_span": feature_span,
+        "feature_mean": features.mean().to_numpy(),
+        "feature_std": features.std(ddof=0).to_numpy(),
+        "last_id": int(data["id"].iloc[-1]),
+        "last_row": last_row_state(data),
+        "recent_predictions": predictions.astype(np.int8),
+    }
+    return state, anomaly_labels(data["id"], predictions, scores)
+
+# Function to measure how far new rows moved away from the training data,
+# in training standard deviations of the worst feature
+def feature_drift(state, features):
+    if len(features) < DRIFT_MIN_ROWS:
+        return 0.0
+    std = np.where(state["feature_std"] > 0, state["feature_std"], 1.0)
+    shift = np.abs(features.mean().to_numpy() - state["feature_mean"]) / std
+    return float(np.nanmax(shift))
+
+# Function to decide whether the persisted model must be refitted
+def refit_reason(state, source):
+    if state is None:
+        return "no usable persisted model"
+    if state["source"] != source:
+        return f"entropy_scores source changed from {state['source']} to {source}"
+    fitted_at = datetime.strptime(state["fitted_at"], '%Y-%m-%d %H:%M:%S')
+    if datetime.now() - fitted_at >= timedelta(hours=REFIT_HOURS):
+        return f"model older than {REFIT_HOURS:g}h"
+    return None
+
+# Function to insert the results into the database. With conn given the
+# row joins the caller's transaction instead of committing on its own.
+# mode ("batch" or "stream") tags the row.
+# labels are (entropy_id, label, score) for the rows scored this run; they
+# go to ransomware_anomaly_labels, one row per entropy_scores row and mode,
+# and anomaly_raw_data is no longer filled. reset_labels first drops the
+# VM's labels of that mode (their entropy_ids belong to an old source).
+def insert_analysis_results(vmid, timestamp, labels, anomaly_percentage, mode="batch", conn=None,
+                            reset_labels=False):
+    own_conn = conn is None
+    if own_conn:
+        db_path = ASPAR_DB
+        conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
 
     # Create an insert query with the results
     insert_query = """
-    INSERT INTO ransomware_analysis_results (vmid, timestamp, anomaly_raw_data, anomaly_percentage)
-    VALUES (?, ?, ?, ?)
+    INSERT INTO ransomware_analysis_results (vmid, timestamp, anomaly_raw_data, anomaly_percentage, mode)
+    VALUES (?, ?, NULL, ?, ?)
     """
-    
-    # Prepare anomaly data as a string of raw results
-    anomaly_raw_data_str = ', '.join(map(str, anomaly_raw_data))
-    
-    cursor.execute(insert_query, (vmid, timestamp, anomaly_raw_data_str, anomaly_percentage))
-    conn.commit()
-    conn.close()
+    cursor.execute(insert_query, (vmid, timestamp, anomaly_percentage, mode))
+
+    if reset_labels:
+        cursor.execute("DELETE FROM ransomware_anomaly_labels WHERE vmid = ? AND mode = ?", (vmid, mode))
+
+    # A refit relabels its training window; the newest label of a mode wins
+    cursor.executemany("""
+    INSERT OR REPLACE INTO ransomware_anomaly_labels (vmid, mode, entropy_id, label, score, timestamp)
+    VALUES (?, ?, ?, ?, ?, ?)
+    """, [(vmid, mode, entropy_id, label, score, timestamp) for entropy_id, label, score in labels])
+    if own_conn:
+        conn.commit()
+        conn.close()
+
+# Function to refit or incrementally score one VM. fetch(after_id, limit)
+# returns its rows like fetch_entropy_data. Returns (labels,
+# anomaly_percentage, reset_labels, state), or None when the VM has no
+# rows; the caller saves state only once the labels are committed, so a
+# failed insert cannot move last_id past unlabelled rows. reset_labels is
+# set when the source changed (a migration renumbers the ids), so the
+# VM's stored labels no longer match its rows.
+# While the persisted model fits the source, it labels the new rows before
+# any refit, and the rows it flags are kept out of the refit window, so a
+# burst that causes drift cannot train the model that replaces it.
+def score_vm(vmid, source, state, fetch):
+    reason = refit_reason(state, source)
+    reset_labels = state is not None and state["source"] != source
+    labels = []
+    data = None
+    if state is not None and state["source"] == source:
+        # Score only the rows written since the previous tick
+        data = fetch(state["last_id"], None)
+        logging.info(f"New rows fetched for VMID: {vmid}, Rows: {len(data)}")
+        features = model_features(state, data)
+        if not data.empty:
+            logging.info("Scoring new rows with the persisted Isolation Forest model...")
+            predictions, scores = isolation_forest_scores(state["model"], features)
+            labels = anomaly_labels(data["id"], predictions, scores)
+        if reason is None:
+            drift = feature_drift(state, features)
+            if drift > DRIFT_THRESHOLD:
+                reason = f"feature drift {drift:.2f} > {DRIFT_THRESHOLD:g}"
+
+    new_state = None
+    if reason is not None:
+        logging.info(f"Refitting Isolation Forest model for VMID: {vmid} ({reason})...")
+        window = fetch(0, TRAIN_WINDOW)
+        flagged = {entropy_id for entropy_id, label, _ in labels if label == -1}
+        if flagged:
+            logging.info(f"Leaving {len(flagged)} flagged new row(s) out of the refit window.")
+        new_state, refit_labels = fit_model_state(
+            window[~window["id"].isin(flagged)].reset_index(drop=True), source)
+        if new_state is None and data is None:
+            logging.warning(f"No entropy scores recorded for VMID: {vmid}")
+            return None
+
+    if new_state is not None:
+        # the persisted model's labels of the new rows are kept
+        scored = {entropy_id for entropy_id, _, _ in labels}
+        labels = [label for label in refit_labels if label[0] not in scored] + labels
+        by_id = {entropy_id: label for entropy_id, label, _ in labels}
+        new_state["recent_predictions"] = np.array(
+            [by_id.get(int(i), 1) for i in window["id"]], dtype=np.int8)
+        new_state["last_id"] = int(window["id"].iloc[-1])
+        new_state["last_row"] = last_row_state(window)
+        state = new_state
+    elif not data.empty:
+        state["last_id"] = int(data["id"].iloc[-1])
+        state["last_row"] = last_row_state(data)
+        state["recent_predictions"] = np.concatenate(
+            [state["recent_predictions"], np.array([label for _, label, _ in labels], dtype=np.int8)]
+        )[-TRAIN_WINDOW:]
+
+    # Anomaly percentage over the newest TRAIN_WINDOW scored rows
+    anomaly_percentage = float(np.mean(state["recent_predictions"] == -1))
+    return labels, anomaly_percentage, reset_labels, state
 
 # Main function to run the analysis
 def run_ransomware_analysis(vmid):
     logging.info(f"Running ransomware analysis for VM ID: {vmid}")
     
-    # Fetch the data from the database
-    data = fetch_entropy_data(vmid)
-    logging.info(f"Data fetched for VMID: {vmid}, Rows: {len(data)}")
+    source = entropy_source(vmid)
+    if source is None:
+        logging.warning(f"No entropy scores recorded for VMID: {vmid}")
+        return
 
-    # Drop the 'timestamp' column for model processing
-    model_data = data.drop(columns=['timestamp'])
-    
-    # Run the Isolation Forest model
-    logging.info("Running Isolation Forest model...")
-    anomaly_raw_data, anomaly_percentage = run_isolation_forest(model_data)
+    result = score_vm(vmid, source, load_model_state(vmid),
+                      lambda after_id, limit: fetch_entropy_data(vmid, after_id, limit))
+    if result is None:
+        return
+    labels, anomaly_percentage, reset_labels, state = result
     
     # Current timestamp
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     
     # Insert results into the database
-    insert_analysis_results(vmid, timestamp, anomaly_raw_data, anomaly_percentage)
+    insert_analysis_results(vmid, timestamp, labels, anomaly_percentage, reset_labels=reset_labels)
+    save_model_state(vmid, state)
     
     logging.info(f"Anomaly detection completed. Anomaly percentage: {anomaly_percentage:.2f}")
     logging.info(f"Data inserted into ransomware_analysis_results table.")
 
+# Function to create the streaming state table if it doesn't exist
+def create_stream_state_table(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS anomaly_stream_state (
+        vmid TEXT PRIMARY KEY,
+        state_version INTEGER,
+        source TEXT,
+        last_id INTEGER,
+        n INTEGER,
+        mean BLOB,
+        var BLOB,
+        anomaly_rate REAL,
+        updated_at TEXT
+    );
+    """)
+
+# Function to load the streaming state of a VM, or a fresh one when it is
+# missing, stamped by another STREAM_STATE_VERSION or built on other ids
+def load_stream_state(conn, vmid, source):
+    row = conn.execute("""
+        SELECT state_version, source, last_id, n, mean, var, anomaly_rate
+        FROM anomaly_stream_state WHERE vmid = ?
+    """, (vmid,)).fetchone()
+    if row is None or row[0] != STREAM_STATE_VERSION or row[1] != source:
+        return None
+    return {
+        "last_id": row[2],
+        "n": row[3],
+        "mean": np.frombuffer(row[4], dtype=np.float64).copy(),
+        "var": np.frombuffer(row[5], dtype=np.float64).copy(),
+        "anomaly_rate": row[6],
+    }
+
+# Function to save the streaming state of a VM
+def save_stream_state(conn, vmid, source, state):
+    conn.execute("""
+        INSERT OR REPLACE INTO anomaly_stream_state
+            (vmid, state_version, source, last_id, n, mean, var, anomaly_rate, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (vmid, STREAM_STATE_VERSION, source, state["last_id"], state["n"],
+          state["mean"].tobytes(), state["var"].tobytes(), state["anomaly_rate"],
+          datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+
+# Function to score one feature vector and fold it into the state in O(1).
+# Returns (prediction, score): 1 (normal) or -1 (anomaly) like
+# IsolationForest, and max |z| - STREAM_Z_THRESHOLD (None while warming up).
+def stream_update(state, x):
+    x = np.asarray(x, dtype=np.float64)
+    x = np.where(np.isfinite(x), x, state["mean"])
+    prediction, score = 1, None
+    if state["n"] >= STREAM_WARMUP:
+        sd = np.sqrt(state["var"] + (STREAM_REL_FLOOR * state["mean"]) ** 2 + STREAM_EPS)
+        z = np.abs(x - state["mean"]) / sd
+        score = float(z.max() - STREAM_Z_THRESHOLD)
+        if score > 0:
+            prediction = -1
+        # Winsorize so a burst of anomalies only drags the baseline slowly
+        x = np.clip(x, state["mean"] - STREAM_CLIP_Z * sd, state["mean"] + STREAM_CLIP_Z * sd)
+    # Cumulative average during warm-up, EWMA afterwards
+    alpha = max(STREAM_ALPHA, 1.0 / (state["n"] + 1))
+    diff = x - state["mean"]
+    state["mean"] = state["mean"] + alpha * diff
+    state["var"] = (1.0 - alpha) * (state["var"] + alpha * diff * diff)
+    state["n"] += 1
+    state["anomaly_rate"] += STREAM_RATE_ALPHA * ((prediction == -1) - state["anomaly_rate"])
+    return prediction, score
+
+# Function to feed one VM's new rows to its streaming state and record the
+# result, inside the caller's transaction. Returns the anomaly percentage.
+def stream_analyse(conn, vmid, source):
+    state = load_stream_state(conn, vmid, source)
+    query = f"""
+        SELECT id, {', '.join(MODEL_FEATURES)}
+        FROM entropy_scores_{vmid.replace('-', '')}
+        WHERE id > ? ORDER BY id
+    """
+    # a fresh state (first run, new version or new source) relabels from scratch
+    reset_labels = state is None
+    if state is None:
+        # Fresh state: warm up on the newest TRAIN_WINDOW rows only
+        state = {"last_id": 0, "n": 0, "anomaly_rate": 0.0,
+                 "mean": np.zeros(len(MODEL_FEATURES)), "var": np.zeros(len(MODEL_FEATURES))}
+        start = conn.execute(f"""
+            SELECT id FROM entropy_scores_{vmid.replace('-', '')}
+            ORDER BY id DESC LIMIT 1 OFFSET ?
+        """, (TRAIN_WINDOW,)).fetchone()
+        state["last_id"] = start[0] if start else 0
+    labels = []
+    for row in conn.execute(query, (state["last_id"],)):
+        labels.append((row[0], *stream_update(state, row[1:])))
+        state["last_id"] = row[0]
+    logging.info(f"New rows scored for VMID: {vmid}, Rows: {len(labels)}")
+    save_stream_state(conn, vmid, source, state)
+    anomaly_percentage = float(state["anomaly_rate"])
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    insert_analysis_results(vmid, timestamp, labels, anomaly_percentage, mode="stream", conn=conn,
+                            reset_labels=reset_labels)
+    return anomaly_percentage
+
+# Function to run the streaming detector over the rows written since its
+# last update. State, results and last_id are committed together, so
+# concurrent callers (cron and the entropy_analysis.py hook) never score a
+# row twice.
+def run_stream_analysis(vmid):
+    logging.info(f"Running streaming ransomware analysis for VM ID: {vmid}")
+    create_table_if_not_exists()
+    source = entropy_source(vmid)
+    if source is None:
+        logging.warning(f"No entropy scores recorded for VMID: {vmid}")
+        return
+
+    db_path = ASPAR_DB
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    try:
+        create_stream_state_table(conn)
+        conn.execute("BEGIN IMMEDIATE")
+        anomaly_percentage = stream_analyse(conn, vmid, source)
+        conn.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+    logging.info(f"Anomaly detection completed. Anomaly percentage: {anomaly_percentage:.2f}")
+    logging.info(f"Data inserted into ransomware_analysis_results table.")
+
+# Function to put the hyphens back into a sanitized 32-hex-digit VM UUID
+def canonical_vm_id(sanitized_vmid):
+    if re.fullmatch(r"[0-9a-fA-F]{32}", sanitized_vmid):
+        s = sanitized_vmid
+        return f"{s[:8]}-{s[8:12]}-{s[12:16]}-{s[16:20]}-{s[20:]}"
+    return sanitized_vmid
+
+# Function to list every VM with entropy scores and where they live:
+# 'view' for VMs in the fleet-wide entropy_scores table, 'table' for
+# per-VM tables entropy_analysis.py has not migrated yet
+def fleet_sources():
+    db_path = ASPAR_DB
+    conn = sqlite3.connect(db_path)
+    sources = {}
+    for name, kind in conn.execute("""
+        SELECT name, type FROM sqlite_master
+        WHERE type IN ('table', 'view') AND name GLOB 'entropy_scores_*'
+    """):
+        sources[canonical_vm_id(name[len("entropy_scores_"):])] = kind
+    conn.close()
+    return sources
+
+# Function to fetch the fleet's rows in one query: per VM, the rows after
+# floor_id, capped at the newest TRAIN_WINDOW. Empty when entropy_scores
+# does not exist yet (only per-VM tables, fetched one by one)
+def fetch_fleet_data(floor_id):
+    db_path = ASPAR_DB
+    conn = sqlite3.connect(db_path)
+    exists = conn.execute("""
+        SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'entropy_scores'
+    """).fetchone() is not None
+    conn.close()
+    if not exists:
+        return {}
+    query = f"""
+        SELECT vm_id, id, timestamp, {', '.join(MODEL_FEATURES)} FROM (
+            SELECT vm_id, id, timestamp, {', '.join(MODEL_FEATURES)},
+                   ROW_NUMBER() OVER (PARTITION BY vm_id ORDER BY id DESC) AS newest
+            FROM entropy_scores WHERE id > ?
+        ) WHERE newest <= ?
+        ORDER BY vm_id, id
+    """
+    conn = sqlite3.connect(db_path)
+    data = pd.read_sql_query(query, conn, params=(floor_id, TRAIN_WINDOW))
+    conn.close()
+    return {vmid: rows.drop(columns=["vm_id"]).reset_index(drop=True)
+            for vmid, rows in data.groupby("vm_id", sort=False)}
+
+# Function to score one VM in a fleet worker. frame holds the VM's rows
+# after floor_id; older rows (a drift refit) or VMs left out of the fleet
+# query (frame None: per-VM tables and planned refits) are fetched directly.
+def score_fleet_vm(vmid, source, state, frame, floor_id):
+    def fetch(after_id, limit):
+        if frame is None or after_id < floor_id:
+            return fetch_entropy_data(vmid, after_id, limit)
+        rows = frame[frame["id"] > after_id]
+        return rows if limit is None else rows.tail(limit)
+    try:
+        return vmid, score_vm(vmid, source, state, fetch)
+    except Exception as e:
+        logging.error(f"Ransomware analysis for VMID: {vmid} failed: {e}")
+        return vmid, None
+
+# Function to analyse every VM in one process. Batch models are fitted and
+# scored in parallel; all result rows are committed in one transaction.
+def run_fleet_analysis(mode="batch", workers=ML_WORKERS):
+    create_table_if_not_exists()
+    sources = fleet_sources()
+    logging.info(f"Running fleet {mode} ransomware analysis for {len(sources)} VM(s)")
+    if not sources:
+        return
+
+    db_path = ASPAR_DB
+    if mode == "stream":
+        conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        try:
+            create_stream_state_table(conn)
+            conn.execute("BEGIN IMMEDIATE")
+            for vmid, source in sources.items():
+                stream_analyse(conn, vmid, source)
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return
+
+    # The fleet query only serves VMs in entropy_scores whose model stays:
+    # it starts at the oldest of their last_ids (ids of per-VM tables are
+    # another numbering). Refits fetch their training window one VM at a
+    # time, so one refit does not pull TRAIN_WINDOW rows of every VM.
+    states = {vmid: load_model_state(vmid) for vmid in sources}
+    refits = {vmid for vmid, source in sources.items() if refit_reason(states[vmid], source) is not None}
+    kept = [states[vmid]["last_id"] for vmid, source in sources.items()
+            if source == "view" and vmid not in refits]
+    floor_id = min(kept, default=0)
+    frames = fetch_fleet_data(floor_id) if kept else {}
+    # Scoring new rows is cheap; worker processes only pay off for refits
+    results = Parallel(n_jobs=max(1, min(workers, len(refits))))(
+        delayed(score_fleet_vm)(
+            vmid, source, states[vmid],
+            frames.get(vmid, pd.DataFrame(columns=["id", "timestamp"] + MODEL_FEATURES))
+            if source == "view" and vmid not in refits else None,
+            floor_id)
+        for vmid, source in sources.items()
+    )
+
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        with conn:
+            for vmid, result in results:
+                if result is not None:
+                    labels, anomaly_percentage, reset_labels, _ = result
+                    insert_analysis_results(vmid, timestamp, labels, anomaly_percentage, conn=conn,
+                                            reset_labels=reset_labels)
+    finally:
+        conn.close()
+    # the models move past their scored rows only once those are committed
+    for vmid, result in results:
+        if result is not None:
+            save_model_state(vmid, result[3])
+    scored = sum(result is not None for _, result in results)
+    logging.info(f"Fleet analysis completed: {scored} of {len(results)} VM(s) inserted into ransomware_analysis_results.")
+
 # Example usage
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ransomware anomaly detection over entropy_scores.")
+    parser.add_argument("vmid", nargs="?", default="c05c2a4a-aa00-44ed-a92e-8a68869543a0")
+    parser.add_argument("--mode", choices=["batch", "stream"], default=ML_MODE,
+                        help="persisted IsolationForest (batch) or online EWMA z-scores (stream)")
+    parser.add_argument("--fleet", action="store_true", help="analyse every VM with entropy scores")
+    parser.add_argument("--workers", type=int, default=ML_WORKERS, help="parallel model fits in --fleet mode")
+    parser.add_argument("--export-labels", metavar="PATH",
+                        help="write the VM's --mode labels to PATH as .npy (a directory of <vm>.npy with --fleet) and exit")
+    parser.add_argument("--compact-results", action="store_true",
+                        help="clear old anomaly_raw_data strings, VACUUM aspar.db and exit")
+    args = parser.parse_args()
     create_table_if_not_exists()  # Ensure the table exists
-    vmid_input = "c05c2a4a-aa00-44ed-a92e-8a68869543a0"  # Replace with the VM ID input
-    run_ransomware_analysis(vmid_input)
+    if args.compact_results:
+        compact_analysis_results()
+    elif args.export_labels and args.fleet:
+        os.makedirs(args.export_labels, exist_ok=True)
+        for vmid in fleet_sources():
+            export_labels(vmid, os.path.join(args.export_labels, f"{vmid.replace('-', '')}.npy"), args.mode)
+    elif args.export_labels:
+        export_labels(args.vmid, args.export_labels, args.mode)
+    elif args.fleet:
+        run_fleet_analysis(args.mode, args.workers)
+    elif args.mode == "stream":
+        run_stream_analysis(args.vmid)
+    else:
+        run_ransomware_analysis(args.vmid)
@@ -8,6 +8,7 @@ PDF_DIR="/backup/aspar/$VM_ID_RAW"
 mkdir -p "$PDF_DIR"
 PDF_FILE="$PDF_DIR/ransomware_openai_${VM_ID_RAW}_report_$(date +"%Y-%m-%d_%H-%M-%S").pdf"
 SETTINGS_DB="/root/vmSettings.db"
+ANOMALY_MODE="${ANOMALY_MODE:-batch}"  # batch or stream; their percentages are not comparable
 
 
 
@@ -26,10 +27,18 @@ CREATE TABLE IF NOT EXISTS ransomware_ai_$SANITIZED_VM_ID (
     analysis_status TEXT DEFAULT 'pending'
 );" 
 
+# Results written before the mode column existed are all batch results
+HAS_MODE=$(sqlite3 "$DB_PATH" "SELECT COUNT(*) FROM pragma_table_info('ransomware_analysis_results') WHERE name='mode';")
+if [ "$HAS_MODE" = "1" ]; then
+    MODE_FILTER="AND IFNULL(mode, 'batch')='$ANOMALY_MODE'"
+else
+    MODE_FILTER="AND '$ANOMALY_MODE'='batch'"
+fi
+
 # Extract the latest anomaly percentage
-ANOMALY_PERCENTAGE=$(sqlite3 "$DB_PATH" "SELECT printf('%.6f', anomaly_percentage) FROM ransomware_analysis_results WHERE vmid='$VM_ID_RAW' ORDER BY id DESC LIMIT 1;")
-MEAN=$(sqlite3 "$DB_PATH" "SELECT printf('%.6f', IFNULL(avg(anomaly_percentage), 0)) FROM ransomware_analysis_results WHERE vmid='$VM_ID_RAW';")
-STDEV=$(sqlite3 "$DB_PATH" "SELECT printf('%.6f', IFNULL(sqrt(avg((anomaly_percentage - $MEAN)*(anomaly_percentage - $MEAN))), 0)) FROM ransomware_analysis_results WHERE vmid='$VM_ID_RAW';")
+ANOMALY_PERCENTAGE=$(sqlite3 "$DB_PATH" "SELECT printf('%.6f', anomaly_percentage) FROM ransomware_analysis_results WHERE vmid='$VM_ID_RAW' $MODE_FILTER ORDER BY id DESC LIMIT 1;")
+MEAN=$(sqlite3 "$DB_PATH" "SELECT printf('%.6f', IFNULL(avg(anomaly_percentage), 0)) FROM ransomware_analysis_results WHERE vmid='$VM_ID_RAW' $MODE_FILTER;")
+STDEV=$(sqlite3 "$DB_PATH" "SELECT printf('%.6f', IFNULL(sqrt(avg((anomaly_percentage - $MEAN)*(anomaly_percentage - $MEAN))), 0)) FROM ransomware_analysis_results WHERE vmid='$VM_ID_RAW' $MODE_FILTER;")
 
 
 # Debug output